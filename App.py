@@ -5,9 +5,81 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
+from sklearn.inspection import permutation_importance
 import requests
+import os
+import json
+import hashlib
+import sys
+import threading
+import time
+import joblib
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Optional
+from feature_engineering import AGE_LABELS, SPENDING_LABELS, MONTH_ORDER, clean_data
+from aggregation import CUBE_DIMENSIONS, aggregate_cube, bincount_agg
+from rfm import score_rfm
+from importance import MODEL_FEATURES, CATEGORICAL_FEATURES, encode_features, train_importance_model
+from process_memory import process_memory_mb
+from shared_frame import read_store, share_frame
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Data and cache locations (override with environment variables)
+DATA_PATH = os.environ.get('DIWALI_DATA_PATH', 'Diwali Sales Data.csv')
+CACHE_DIR = os.environ.get('DIWALI_CACHE_DIR', '.cache')
+# Rows per chunk for streaming ingestion; 0 parses the whole CSV at once
+INGEST_CHUNKSIZE = int(os.environ.get('DIWALI_INGEST_CHUNKSIZE', 0))
+# CSV parser for single-pass loads: 'pandas' (default) or the multithreaded 'arrow' reader
+PARSE_ENGINE = os.environ.get('DIWALI_PARSE_ENGINE', 'pandas')
+# Memory cap for the process-wide cache of per-section aggregate results
+RESULT_CACHE_MB = float(os.environ.get('DIWALI_RESULT_CACHE_MB', 64))
+# Group-by backend for categorical keys: 'numpy' (bincount kernels) or 'pandas'
+AGGREGATION_BACKEND = os.environ.get('DIWALI_AGGREGATION_BACKEND', 'numpy')
+# KPI totals: 'delta' (per-session totals moved by the toggled filter values' slices) or 'full'
+KPI_MAINTENANCE = os.environ.get('DIWALI_KPI_MAINTENANCE', 'delta')
+# HyperLogLog precision for approximate unique customers: 2**p one-byte registers per cube cell.
+# Below 11 the hash tail no longer fits a float64 mantissa; above 16 the registers outgrow the gain
+HLL_PRECISION = int(os.environ.get('DIWALI_HLL_PRECISION', 12))
+if not 11 <= HLL_PRECISION <= 16:
+    raise ValueError(f"DIWALI_HLL_PRECISION must be between 11 and 16, got {HLL_PRECISION}")
+# Approximate mode answers KPIs and charts from a stratified sample; the exact cube is built
+# in the background only when a user refines, instead of at load
+APPROXIMATE_QUERIES = os.environ.get('DIWALI_APPROXIMATE_QUERIES', '0') == '1'
+SAMPLE_FRACTION = float(os.environ.get('DIWALI_SAMPLE_FRACTION', 0.01))
+# Smallest sample per stratum, so rare strata still get a usable variance estimate
+SAMPLE_MIN_ROWS = int(os.environ.get('DIWALI_SAMPLE_MIN_ROWS', 30))
+# Bins per RFM histogram; integer measures with a narrower range get one bin per value
+RFM_HISTOGRAM_BINS = int(os.environ.get('DIWALI_RFM_HISTOGRAM_BINS', 40))
+# Feature-importance engine: 'rf' (random forest) or 'hgb' (histogram gradient boosting on
+# native categorical codes), with optional stratified row sampling and a tree depth cap
+IMPORTANCE_MODE = os.environ.get('DIWALI_IMPORTANCE_MODE', 'rf')
+IMPORTANCE_SAMPLE = float(os.environ.get('DIWALI_IMPORTANCE_SAMPLE', 1.0))
+IMPORTANCE_MAX_DEPTH = int(os.environ.get('DIWALI_IMPORTANCE_MAX_DEPTH', 0)) or None
+# Rows of the filtered segment scored when attributing importance to a sidebar selection
+SEGMENT_IMPORTANCE_ROWS = int(os.environ.get('DIWALI_SEGMENT_IMPORTANCE_ROWS', 5000))
+# Upper bound on the what-if grid scored in one predict call
+WHAT_IF_MAX_SCENARIOS = int(os.environ.get('DIWALI_WHAT_IF_MAX_SCENARIOS', 500000))
+# In batch filter mode, a pending selection left untouched this long is applied without a click (0: button only)
+FILTER_DEBOUNCE_SECONDS = float(os.environ.get('DIWALI_FILTER_DEBOUNCE_SECONDS', 1.5))
+# Bump whenever the cleaning/feature rules in feature_engineering.py change so stale stores are rebuilt
+CACHE_FORMAT = 4
+
+# Memory-compact schema: low-cardinality text as categoricals, integers downcast to the narrowest type
+CATEGORY_COLUMNS = ['Gender', 'Age_Group', 'State', 'Zone', 'Occupation', 'Product_Category',
+                    'Cust_name', 'Product_ID', 'Age_Category']
+INTEGER_COLUMNS = ['User_ID', 'Age', 'Married', 'Orders', 'Amount']
+
+# Derived columns are rebuilt from the columnar store as ordered categoricals
+DERIVED_CATEGORIES = {'Age_Category': AGE_LABELS, 'Spending_Segment': SPENDING_LABELS, 'Month': MONTH_ORDER}
 
 # Enhanced page config with elegant Diwali theme
 st.set_page_config(
@@ -661,72 +733,861 @@ setInterval(() => {
 st.components.v1.html(firework_script)
 
 # Load and preprocess data
-@st.cache_data
-def load_data():
-    # Load data from CSV
-    df = pd.read_csv('Diwali Sales Data.csv', encoding='unicode_escape')
-    
-    # Data cleaning steps
-    df.drop(['Status', 'unnamed1'], axis=1, inplace=True, errors='ignore')
-    df.dropna(inplace=True)
-    df['Amount'] = df['Amount'].astype(int)
-    df.rename(columns={'Marital_Status': 'Married', 'Age Group': 'Age_Group'}, inplace=True)
-    
-    # Feature engineering
-    df['Age_Category'] = df['Age'].apply(lambda x: 
-        'Teen (0-19)' if x < 20 else 
-        'Young Adult (20-29)' if x < 30 else 
-        'Adult (30-39)' if x < 40 else 
-        'Middle Age (40-49)' if x < 50 else 
-        'Senior (50+)')
-    
-    df['Spending_Segment'] = pd.cut(df['Amount'], 
-        bins=[0, 5000, 10000, 15000, 20000, float('inf')],
-        labels=['Low (<5k)', 'Medium (5-10k)', 'High (10-15k)', 
-                'Premium (15-20k)', 'Elite (20k+)'])
-    
-    # Create month column from date
-    if 'Date' in df.columns:
-        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-        df['Month'] = df['Date'].dt.month_name()
-    
+# pandas' default NA markers, so both parse engines drop the same rows
+NULL_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+               '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+def read_csv(path):
+    if PARSE_ENGINE == 'arrow':
+        # Arrow transcodes latin-1 while parsing on all cores; without backslash escapes in the
+        # file this decodes every byte (e.g. the 0xA0 in 'Andhra Pradesh') exactly like unicode_escape
+        table = pa_csv.read_csv(
+            path,
+            read_options=pa_csv.ReadOptions(encoding='latin-1', use_threads=True),
+            convert_options=pa_csv.ConvertOptions(null_values=NULL_VALUES, strings_can_be_null=True)
+        )
+        return table.to_pandas()
+    return pd.read_csv(path, encoding='unicode_escape')
+
+def source_fingerprint(path):
+    # Size and mtime are cheap to check; the content hash is only recomputed when they change
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    manifest_path = os.path.join(CACHE_DIR, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    entry = manifest.get(key, {})
+    if entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+        return entry['hash']
+    
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    manifest[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest.hexdigest()}
+    
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    return manifest[key]['hash']
+
+def apply_schema(df):
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in INTEGER_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
     return df
 
-df = load_data()
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
 
-# Train Random Forest model for feature importance
-@st.cache_data
-def train_rf_model(data):
-    # Prepare data for modeling
-    model_df = data.copy()
-    
-    # Encode categorical features
-    le = LabelEncoder()
-    cat_cols = ['Gender', 'Age_Category', 'State', 'Occupation', 'Product_Category']
-    for col in cat_cols:
-        model_df[col] = le.fit_transform(model_df[col])
-    
-    # Features and target
-    X = model_df[['Gender', 'Age_Category', 'State', 'Occupation', 'Product_Category', 'Orders']]
-    y = model_df['Amount']
-    
-    # Train model
-    rf = RandomForestRegressor(n_estimators=100, random_state=42)
-    rf.fit(X, y)
-    
-    # Get feature importances
-    importances = rf.feature_importances_
-    features = X.columns
-    feature_importance = pd.DataFrame({'Feature': features, 'Importance': importances})
-    feature_importance = feature_importance.sort_values('Importance', ascending=False)
+def peak_rss_mb():
+    # Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+def private_mb():
+    # Anonymous (non file-backed) resident memory of this process; None off Linux
+    memory = process_memory_mb()
+    return memory['RssAnon'] if memory else None
+
+def write_validity(values, path, chunksize):
+    # Arrow validity bits for a memory-mapped column (codes of -1 or NaN/NaT are missing), packed a
+    # whole number of bytes at a time
+    step = -(-chunksize // 8) * 8
+    with open(path, 'wb') as f:
+        for start in range(0, len(values), step):
+            part = values[start:start + step]
+            np.packbits(part >= 0 if part.dtype.kind == 'i' else ~pd.isna(part), bitorder='little').tofile(f)
+
+def ingest_chunked(path, store_tmp_path, chunksize):
+    # Stream the CSV through clean_data and build the store a chunk at a time, so private memory is bounded
+    # by the chunk size plus the text dictionaries whatever the input size. Writes the store to
+    # store_tmp_path and returns the load report
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    memory_before = 0.0
+    peak_private = 0.0
+    text_values = {}
+    integer_ranges = {}
+    with tempfile.TemporaryDirectory(dir=CACHE_DIR, prefix='ingest_') as work_dir:
+        # Pass 1: stage the cleaned chunks and collect what the final schema depends on, the distinct
+        # values of every text column and the range of every integer column
+        staging_path = os.path.join(work_dir, 'staging.arrow')
+        writer = None
+        try:
+            for chunk in pd.read_csv(path, encoding='unicode_escape', chunksize=chunksize):
+                chunk = clean_data(chunk)
+                memory_before += memory_mb(chunk)
+                
+                # Categories differ between chunks, so derived columns are staged as plain text
+                for col in chunk.select_dtypes('category').columns:
+                    chunk[col] = chunk[col].astype(object)
+                for col in chunk.select_dtypes(object).columns:
+                    if col not in DERIVED_CATEGORIES:
+                        text_values.setdefault(col, set()).update(chunk[col].dropna().unique())
+                for col in INTEGER_COLUMNS:
+                    if col in chunk.columns and len(chunk):
+                        low, high, integral = integer_ranges.get(col, (chunk[col].min(), chunk[col].max(), True))
+                        integer_ranges[col] = (min(low, chunk[col].min()), max(high, chunk[col].max()),
+                                               integral and pd.to_numeric(chunk[col], downcast='integer').dtype.kind in 'iu')
+                
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pa.ipc.new_file(staging_path, schema)
+                writer.write_table(table.cast(schema))
+                peak_private = max(peak_private, private_mb() or 0)
+        finally:
+            if writer is not None:
+                writer.close()
+        
+        # The dtypes apply_schema would give the whole frame
+        dtypes = {}
+        for field in schema:
+            if field.name in DERIVED_CATEGORIES:
+                dtypes[field.name] = pd.CategoricalDtype(DERIVED_CATEGORIES[field.name], ordered=True)
+            elif pa.types.is_string(field.type):
+                dtypes[field.name] = pd.CategoricalDtype(sorted(text_values.get(field.name, ())))
+            elif field.name in integer_ranges and integer_ranges[field.name][2]:
+                low, high, _ = integer_ranges[field.name]
+                dtypes[field.name] = pd.to_numeric(pd.Series([low, high]), downcast='integer').dtype
+            else:
+                dtypes[field.name] = np.dtype(field.type.to_pandas_dtype())
+        
+        # Pass 2: convert each staged chunk to the final dtypes and append every column to its own file
+        # of raw values (categorical codes for text)
+        column_paths = {col: os.path.join(work_dir, f"column_{i}") for i, col in enumerate(dtypes)}
+        has_nulls = dict.fromkeys(dtypes, False)
+        storage_dtypes = {}
+        rows = 0
+        column_files = {col: open(column_path, 'wb') for col, column_path in column_paths.items()}
+        try:
+            with pa.OSFile(staging_path) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    batch = reader.get_batch(i).to_pandas()
+                    for col, dtype in dtypes.items():
+                        if isinstance(dtype, pd.CategoricalDtype):
+                            values = pd.Categorical(batch[col], dtype=dtype).codes
+                            has_nulls[col] |= bool((values < 0).any())
+                        else:
+                            values = batch[col].to_numpy().astype(dtype, copy=False)
+                            has_nulls[col] |= bool(pd.isna(values).any())
+                        storage_dtypes[col] = values.dtype
+                        values.tofile(column_files[col])
+                    rows += len(batch)
+                    del batch
+                    peak_private = max(peak_private, private_mb() or 0)
+        finally:
+            for column_file in column_files.values():
+                column_file.close()
+        os.remove(staging_path)
+        
+        # One record batch over the memory-mapped column files (the layout read_store expects); the
+        # writer streams each column from the page cache into the store without a private copy
+        store_schema = pa.Schema.from_pandas(
+            pd.DataFrame({col: pd.Series([], dtype=dtype) for col, dtype in dtypes.items()}), preserve_index=False
+        )
+        sources = []
+        try:
+            arrays = []
+            for field in store_schema:
+                sources.append(pa.memory_map(column_paths[field.name]))
+                data = sources[-1].read_buffer()
+                validity = None
+                if has_nulls[field.name]:
+                    validity_path = f"{column_paths[field.name]}_validity"
+                    write_validity(np.frombuffer(data, dtype=storage_dtypes[field.name]), validity_path, chunksize)
+                    sources.append(pa.memory_map(validity_path))
+                    validity = sources[-1].read_buffer()
+                if pa.types.is_dictionary(field.type):
+                    indices = pa.Array.from_buffers(field.type.index_type, rows, [validity, data])
+                    arrays.append(pa.DictionaryArray.from_arrays(
+                        indices, pa.array(dtypes[field.name].categories, type=field.type.value_type),
+                        ordered=field.type.ordered
+                    ))
+                else:
+                    arrays.append(pa.Array.from_buffers(field.type, rows, [validity, data]))
+            with pa.ipc.new_file(store_tmp_path, store_schema) as writer:
+                writer.write_batch(pa.record_batch(arrays, schema=store_schema))
+            peak_private = max(peak_private, private_mb() or 0)
+        finally:
+            for source in sources:
+                source.close()
+    
+    return {'memory_before_mb': memory_before, 'peak_private_mb': peak_private or None}
+
+def store_path(data_version):
+    return os.path.join(CACHE_DIR, f"diwali_{data_version}_v{CACHE_FORMAT}.feather")
+
+def write_store(df, tmp_path):
+    # Uncompressed, single record batch: readers can memory-map every column without copying
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    df.to_feather(tmp_path, compression='uncompressed', chunksize=max(len(df), 1))
+
+def publish_store(tmp_path, path, report):
+    # Stores are built under a temporary name and renamed into place, so concurrent workers never read a
+    # partial store; the report goes first so a published store always has one
+    report_tmp_path = f"{path}.json.{os.getpid()}.tmp"
+    with open(report_tmp_path, 'w') as f:
+        json.dump(report, f)
+    os.replace(report_tmp_path, f"{path}.json")
+    os.replace(tmp_path, path)
+    
+    # Drop stores (and their reports) built from older versions of the CSV
+    current = os.path.basename(path)
+    for name in os.listdir(CACHE_DIR):
+        stale = os.path.join(CACHE_DIR, name)
+        if name.startswith('diwali_') and not name.startswith(current) and not name.endswith('.tmp'):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+def dataset_fingerprint(df, data_version):
+    # Source file hash plus schema: O(columns), so reruns never pay an O(rows) hash for a cache key
+    schema = ';'.join(f"{col}:{dtype}" for col, dtype in df.dtypes.items())
+    return hashlib.blake2b(f"{data_version}|{schema}".encode(), digest_size=16).hexdigest()
+
+@st.cache_resource(max_entries=1)
+def load_data(data_version):
+    # cache_resource hands every rerun of every session this same object instead of a deserialized copy
+    path = store_path(data_version)
+    if not os.path.exists(path):
+        # Load data from CSV, streaming it in chunks straight into the store when a chunk size is configured
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if INGEST_CHUNKSIZE:
+            report = ingest_chunked(DATA_PATH, tmp_path, INGEST_CHUNKSIZE)
+        else:
+            df = clean_data(read_csv(DATA_PATH))
+            report = {'memory_before_mb': memory_mb(df), 'engine': PARSE_ENGINE}
+            write_store(apply_schema(df), tmp_path)
+            del df
+        # Measured on the memory-mapped store, so the chunked path never builds the frame in memory
+        report['memory_after_mb'] = memory_mb(read_store(tmp_path))
+        report['chunksize'] = INGEST_CHUNKSIZE
+        report['peak_rss_mb'] = peak_rss_mb()
+        publish_store(tmp_path, path, report)
+    
+    # Every worker, including the one that just built it, serves the memory-mapped store
+    with open(f"{path}.json") as f:
+        report = json.load(f)
+    df = share_frame(read_store(path))
+    df.attrs['load_report'] = report
+    df.attrs['fingerprint'] = dataset_fingerprint(df, data_version)
+    return df
+
+data_version = source_fingerprint(DATA_PATH)
+df = load_data(data_version)
+
+# Pre-aggregated cube over CUBE_DIMENSIONS (see aggregation.py)
+@st.cache_resource
+def build_filter_cube(_data, data_version):
+    # The frame itself is not hashed; data_version identifies it. Like the main frame, the cube is one
+    # shared object that every rerun reads instead of unpickling a copy, so callers must not mutate it
+    return aggregate_cube(_data)
+
+cube = None if APPROXIMATE_QUERIES else build_filter_cube(df, data_version)
+
+# Sample strata; both are cube dimensions, so every cube cell lies in exactly one stratum
+STRATA = ['State', 'Product_Category']
+
+@st.cache_resource
+def build_sample_cube(_data, data_version, fraction, min_rows):
+    # Same columns as the cube, scaled by each stratum's inverse sampling rate, plus the raw
+    # per-cell sample moments the confidence intervals need
+    strata = np.zeros(len(_data), dtype=np.int64)
+    for col in STRATA:
+        strata = strata * len(_data[col].cat.categories) + _data[col].cat.codes.to_numpy()
+    population = np.bincount(strata)
+    
+    # Bernoulli draw at each stratum's rate; given its realised size, each stratum's draw is a
+    # simple random sample, so the realised sizes are used as n_h
+    rate = np.minimum(1, np.maximum(population * fraction, min_rows) / np.maximum(population, 1))
+    positions = np.flatnonzero(np.random.default_rng(42).random(len(strata)) < rate[strata])
+    taken = np.bincount(strata[positions], minlength=len(population))
+    
+    sample = _data.take(positions)[CUBE_DIMENSIONS + ['Amount', 'Orders']]
+    stratum = strata[positions]
+    sample = sample.assign(
+        Amount_sq=sample['Amount'].astype(np.float64) ** 2,
+        Orders_sq=sample['Orders'].astype(np.float64) ** 2,
+        Weight=population[stratum] / taken[stratum],
+        Stratum_N=population[stratum],
+        Stratum_n=taken[stratum]
+    )
+    sample_cube = sample.groupby(CUBE_DIMENSIONS, observed=True, dropna=False).agg(
+        Rows_n=('Amount', 'count'),
+        Amount_s=('Amount', 'sum'),
+        Amount_ss=('Amount_sq', 'sum'),
+        Orders_s=('Orders', 'sum'),
+        Orders_ss=('Orders_sq', 'sum'),
+        Weight=('Weight', 'first'),
+        Stratum_N=('Stratum_N', 'first'),
+        Stratum_n=('Stratum_n', 'first')
+    ).reset_index()
+    return sample_cube.assign(
+        Amount_sum=sample_cube['Amount_s'] * sample_cube['Weight'],
+        Amount_count=sample_cube['Rows_n'] * sample_cube['Weight'],
+        Orders_sum=sample_cube['Orders_s'] * sample_cube['Weight'],
+        Orders_count=sample_cube['Rows_n'] * sample_cube['Weight']
+    )
+
+def stratum_moments(sample_selection, by, column):
+    # Domain sum and sum of squares of one measure within each stratum (and group); a column of
+    # None counts rows, whose indicator is its own square
+    s, ss = ('Rows_n', 'Rows_n') if column is None else (f'{column}_s', f'{column}_ss')
+    keys = STRATA if by is None or by in STRATA else [by] + STRATA
+    return sample_selection.groupby(keys, observed=True).agg(
+        s=(s, 'sum'), ss=(ss, 'sum'), N=('Stratum_N', 'first'), n=('Stratum_n', 'first')
+    )
+
+def stratified_variance(s, ss, N, n):
+    # Stratum variance of the expansion estimator for a domain total, N^2 (1 - n/N) s_h^2 / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = N ** 2 * (1 - n / N) / n * (ss - s ** 2 / n) / (n - 1)
+    return np.where(n > 1, variance, 0.0)
+
+def sample_interval(sample_selection, by=None, column='Amount'):
+    # 95% half-width of the estimated total, per group of `by` or overall
+    moments = stratum_moments(sample_selection, by, column)
+    variance = pd.Series(stratified_variance(moments['s'], moments['ss'], moments['N'], moments['n']), index=moments.index)
+    if by is None:
+        return 1.96 * np.sqrt(variance.sum())
+    return 1.96 * np.sqrt(variance.groupby(level=by, observed=True).sum())
+
+def ratio_interval(sample_selection, column='Amount'):
+    # Average per row is a ratio of two estimated totals; linearised through z = y - R x
+    moments = stratum_moments(sample_selection, None, column)
+    rows = stratum_moments(sample_selection, None, None)['s']
+    total, count = sample_selection[f'{column}_sum'].sum(), sample_selection[f'{column}_count'].sum()
+    ratio = total / count
+    s = moments['s'] - ratio * rows
+    ss = moments['ss'] - 2 * ratio * moments['s'] + ratio ** 2 * rows
+    return 1.96 * np.sqrt(stratified_variance(s, ss, moments['N'], moments['n']).sum()) / count
+
+sample_cube = build_sample_cube(df, data_version, SAMPLE_FRACTION, SAMPLE_MIN_ROWS) if APPROXIMATE_QUERIES else None
+
+# Packed per-value bitmaps for the sidebar filter columns
+FILTER_COLUMNS = ('Gender', 'Age_Category', 'State')
+# Sidebar label and widget key of each filter
+FILTER_WIDGETS = {
+    'Gender': ("Gender", "gender_filter"),
+    'Age_Category': ("Age Group", "age_filter"),
+    'State': ("State", "state_filter")
+}
+
+@st.cache_resource
+def build_filter_index(_data, data_version, columns):
+    index = {}
+    for col in columns:
+        if isinstance(_data[col].dtype, pd.CategoricalDtype):
+            codes, values = _data[col].cat.codes.to_numpy(), _data[col].cat.categories
+        else:
+            codes, values = pd.factorize(_data[col])
+        index[col] = {value: np.packbits(codes == code) for code, value in enumerate(values)}
+    return index
+
+def dimension_bitmap(filter_index, col, selected):
+    # OR of the selected values' bitmaps, reused across reruns while this filter is unchanged
+    masks = st.session_state.setdefault('dimension_masks', {})
+    key = (data_version, col)
+    selected = frozenset(selected)
+    if key in masks and masks[key][0] == selected:
+        return masks[key][1]
+    
+    bitmap = np.zeros_like(next(iter(filter_index[col].values())))
+    for value in selected:
+        if value in filter_index[col]:
+            bitmap |= filter_index[col][value]
+    masks[key] = (selected, bitmap)
+    return bitmap
+
+def selection_bitmap(filter_index, selections):
+    # AND across dimensions
+    mask = None
+    for col, selected in selections.items():
+        bitmap = dimension_bitmap(filter_index, col, selected)
+        mask = bitmap if mask is None else mask & bitmap
+    return mask
+
+def select_rows(filter_index, selections, n_rows):
+    # Gather the selected row positions once
+    return np.flatnonzero(np.unpackbits(selection_bitmap(filter_index, selections), count=n_rows))
+
+BIT_COUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+def count_rows(filter_index, selections):
+    # Popcount of the packed selection, without unpacking it into row positions
+    return int(BIT_COUNTS[selection_bitmap(filter_index, selections)].sum())
+
+filter_index = build_filter_index(df, data_version, FILTER_COLUMNS)
+
+# Process-wide LRU cache of section aggregates, shared by every session
+FIGURE_ARRAYS = ['x', 'y', 'z', 'customdata', 'text', 'hovertext', 'locations', 'labels', 'values']
+
+def result_nbytes(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(result_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(result_nbytes(v) for v in value)
+    if isinstance(value, go.Figure):
+        # Estimated from the traces' data arrays; serializing the figure just to size it costs as much as sending it
+        return sum(result_nbytes(trace[name]) for trace in value.data for name in FIGURE_ARRAYS
+                   if name in trace and trace[name] is not None)
+    if is_dataclass(value):
+        return sum(result_nbytes(getattr(value, field.name)) for field in fields(value))
+    return sys.getsizeof(value)
+
+class ResultCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+    
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        
+        # Compute outside the lock so other sessions are not blocked
+        value = compute()
+        size = result_nbytes(value)
+        with self.lock:
+            if key not in self.entries and size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.nbytes += size
+                while self.nbytes > self.max_bytes:
+                    _, (_, evicted_size) = self.entries.popitem(last=False)
+                    self.nbytes -= evicted_size
+                    self.evictions += 1
+        return value
+
+@st.cache_resource
+def get_result_cache(max_mb):
+    return ResultCache(int(max_mb * 1024 ** 2))
+
+def selection_key(selections):
+    # Order of clicks in a multiselect must not produce a different key
+    return tuple(sorted((col, frozenset(values)) for col, values in selections.items()))
+
+result_cache = get_result_cache(RESULT_CACHE_MB)
+
+# bincount kernels over categorical codes; a drop-in for groupby(by, observed=True).agg(...)
+def group_agg(frame, by, observed=True, **aggregations):
+    if AGGREGATION_BACKEND == 'pandas':
+        return frame.groupby(by, observed=observed).agg(**aggregations)
+    return bincount_agg(frame, by, observed, **aggregations)
+
+# Section rollups come from the (small) selected cube cells; each runs only when its section is shown
+def kpi_aggregates(cube_selection, customers):
+    revenue = cube_selection['Amount_sum'].sum()
+    return {
+        'revenue': revenue,
+        'orders': cube_selection['Orders_sum'].sum(),
+        'avg_spending': revenue / cube_selection['Amount_count'].sum(),
+        'customers': customers
+    }
+
+def demographic_aggregates(cube_selection):
+    gender = group_agg(cube_selection, 'Gender',
+        Amount_count=('Amount_count', 'sum'),
+        Amount_sum=('Amount_sum', 'sum')
+    )
+    age_group = group_agg(cube_selection, 'Age_Category',
+        Customers=('Amount_count', 'sum'),
+        Revenue=('Amount_sum', 'sum'),
+    ).reset_index().sort_values('Revenue', ascending=False)
+    return gender['Amount_count'].sort_values(ascending=False), gender['Amount_sum'], age_group
+
+def geographic_aggregates(cube_selection):
+    state = group_agg(cube_selection, 'State',
+        Revenue=('Amount_sum', 'sum'),
+        Rows=('Amount_count', 'sum')
+    )
+    state_analysis = state.assign(Avg_Spending=state['Revenue'] / state['Rows'])
+    state_analysis = state_analysis.drop(columns='Rows').sort_values('Revenue', ascending=False).head(10)
+    return state_analysis, state['Revenue'].rename('Amount').reset_index()
+
+def product_aggregates(cube_selection):
+    product_analysis = group_agg(cube_selection, 'Product_Category',
+        Orders=('Orders_sum', 'sum'),
+        Revenue=('Amount_sum', 'sum')
+    ).sort_values('Revenue', ascending=False).head(10)
+    spending_segments = group_agg(cube_selection, 'Spending_Segment', observed=False,
+        Rows=('Amount_count', 'sum')
+    )['Rows']
+    return product_analysis, spending_segments
+
+@st.cache_resource
+def build_customer_codes(_data, data_version):
+    # Dense User_ID codes, so counting the distinct customers of any selection is one bincount
+    codes, uniques = pd.factorize(_data['User_ID'])
+    codes.setflags(write=False)
+    # A session's KPI refcount never exceeds a customer's total rows, so the narrowest unsigned type
+    # holding the largest total cannot overflow: 2 bytes per customer per session (20 MB at 10M
+    # customers) instead of 8 for a default int64 bincount
+    max_rows = int(np.bincount(codes).max()) if len(codes) else 0
+    refcount_dtype = np.uint16 if max_rows <= np.iinfo(np.uint16).max else np.uint32
+    return codes, len(uniques), refcount_dtype
+
+def distinct_customers(customer_codes, positions):
+    codes, n_customers, _ = customer_codes
+    return int(np.count_nonzero(np.bincount(codes[positions], minlength=n_customers)))
+
+customer_codes = build_customer_codes(df, data_version)
+
+@st.cache_resource
+def build_value_rows(_data, data_version, columns):
+    # Row positions of every filter value, as views into one stable sort per column. Built on the first
+    # delta maintenance rather than at import, and int32 whenever row numbers fit: 4 bytes per row per
+    # column, private to each worker
+    position_dtype = np.int32 if len(_data) < 2**31 else np.int64
+    value_rows = {}
+    for col in columns:
+        if isinstance(_data[col].dtype, pd.CategoricalDtype):
+            codes, values = _data[col].cat.codes.to_numpy(), _data[col].cat.categories
+        else:
+            codes, values = pd.factorize(_data[col])
+        positions = np.flatnonzero(codes >= 0)
+        order = positions[np.argsort(codes[positions], kind='stable')].astype(position_dtype)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[positions], minlength=len(values)))])
+        value_rows[col] = (codes, pd.Index(values), {
+            value: order[offsets[i]:offsets[i + 1]] for i, value in enumerate(values)
+        })
+    return value_rows
+
+def slice_rows(value_rows, col, value, selections):
+    # Rows holding one value of col that the other dimensions' selections keep; cost follows the value's rows
+    positions = value_rows[col][2].get(value, np.empty(0, dtype=np.intp))
+    for other, selected in selections.items():
+        if other == col or len(positions) == 0:
+            continue
+        codes, values, _ = value_rows[other]
+        # Trailing False so missing values (code -1) never match
+        allowed = np.append(values.isin(list(selected)), False)
+        positions = positions[allowed[codes[positions]]]
+    return positions
+
+def kpi_state(customer_codes, selections):
+    # From scratch: per-customer row counts make the distinct count mergeable under later deltas
+    positions = select_rows(filter_index, selections, len(df))
+    codes, n_customers, refcount_dtype = customer_codes
+    refcount = np.bincount(codes[positions], minlength=n_customers).astype(refcount_dtype)
+    return {
+        'data_version': data_version,
+        'selections': {col: frozenset(selected) for col, selected in selections.items()},
+        'refcount': refcount,
+        'customers': int(np.count_nonzero(refcount)),
+        'revenue': int(df['Amount'].to_numpy()[positions].sum()),
+        'orders': int(df['Orders'].to_numpy()[positions].sum()),
+        'rows': len(positions)
+    }
+
+def apply_slice(state, customer_codes, positions, sign):
+    codes, n_customers, _ = customer_codes
+    refcount = state['refcount']
+    if len(positions) > n_customers:
+        counts = np.bincount(codes[positions], minlength=n_customers)
+        customers = np.flatnonzero(counts)
+        counts = counts[customers]
+    else:
+        customers, counts = np.unique(codes[positions], return_counts=True)
+    counts = counts.astype(refcount.dtype)
+    if sign > 0:
+        state['customers'] += int(np.count_nonzero(refcount[customers] == 0))
+        refcount[customers] += counts
+    else:
+        refcount[customers] -= counts
+        state['customers'] -= int(np.count_nonzero(refcount[customers] == 0))
+    state['revenue'] += sign * int(df['Amount'].to_numpy()[positions].sum())
+    state['orders'] += sign * int(df['Orders'].to_numpy()[positions].sum())
+    state['rows'] += sign * len(positions)
+
+def maintain_kpis(customer_codes, selections):
+    # Each toggled value adds or removes its slice, evaluated against the other dimensions as applied
+    # so far; a change touching more rows than the dataset holds is rebuilt instead
+    value_rows = build_value_rows(df, data_version, FILTER_COLUMNS)
+    state = st.session_state.get('kpi_state')
+    changes = []
+    if state is not None and state['data_version'] == data_version:
+        for col, selected in selections.items():
+            selected = frozenset(selected)
+            changes += [(col, value, 1) for value in selected - state['selections'][col]]
+            changes += [(col, value, -1) for value in state['selections'][col] - selected]
+    
+    if (state is None or state['data_version'] != data_version or
+            sum(len(value_rows[col][2].get(value, ())) for col, value, _ in changes) >= len(df)):
+        state = st.session_state['kpi_state'] = kpi_state(customer_codes, selections)
+    else:
+        for col, value, sign in changes:
+            apply_slice(state, customer_codes, slice_rows(value_rows, col, value, state['selections']), sign)
+            state['selections'][col] = state['selections'][col] ^ {value}
+    
+    return {
+        'revenue': state['revenue'],
+        'orders': state['orders'],
+        'avg_spending': state['revenue'] / state['rows'] if state['rows'] else float('nan'),
+        'customers': state['customers']
+    }
+
+# Distinct counts do not roll up like sums, so each cell keeps a HyperLogLog sketch of its customers;
+# any subset of CUBE_DIMENSIONS works as the cell key
+SKETCH_DIMENSIONS = FILTER_COLUMNS
+
+def splitmix64(values):
+    with np.errstate(over='ignore'):
+        z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+@st.cache_resource
+def build_customer_sketches(_data, data_version, dimensions, precision):
+    grouped = _data.groupby(list(dimensions), observed=True)
+    cells = grouped.size().reset_index()[list(dimensions)]
+    cell = grouped.ngroup().to_numpy()
+    hashes = splitmix64(_data['User_ID'].to_numpy())[cell >= 0]
+    cell = cell[cell >= 0]
+    
+    # The top bits pick a register; it keeps the longest run of leading zeros seen in the rest.
+    # With precision >= 11 (checked at load) the rest fits in a float64 mantissa, so frexp gives its bit length exactly
+    tail_bits = 64 - precision
+    register = (hashes >> np.uint64(tail_bits)).astype(np.int64)
+    tail = (hashes & np.uint64((1 << tail_bits) - 1)).astype(np.float64)
+    rank = tail_bits + 1 - np.frexp(tail)[1]
+    
+    # Max rank per (cell, register) via one sort instead of an unbuffered np.maximum.at
+    keyed = np.unique((cell.astype(np.int64) << precision | register) << 6 | rank)
+    slots = keyed >> 6
+    last = np.append(slots[1:] != slots[:-1], True)
+    registers = np.zeros((len(cells), 1 << precision), dtype=np.uint8)
+    registers.reshape(-1)[slots[last]] = keyed[last] & 63
+    return cells, registers
+
+def estimate_distinct(registers):
+    # HyperLogLog estimate with the linear-counting correction for small cardinalities
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+def sketch_customers(sketches, selections):
+    # Union of the selected cells' sketches is the element-wise register maximum
+    cells, registers = sketches
+    selected = np.logical_and.reduce([cells[col].isin(selections[col]).to_numpy() for col in cells.columns if col in selections])
+    if not selected.any():
+        return 0
+    return estimate_distinct(registers[selected].max(axis=0))
+
+customer_sketches = build_customer_sketches(df, data_version, SKETCH_DIMENSIONS, HLL_PRECISION)
+
+# Per-customer aggregates for the time and segmentation sections
+@dataclass(frozen=True)
+class CustomerAggregates:
+    rfm: pd.DataFrame
+    monthly_sales: Optional[pd.DataFrame] = None
+    daily_sales: Optional[pd.DataFrame] = None
+
+def compute_customer_aggregates(rows):
+    # The selected raw rows are scanned exactly once, grouped by customer (and date);
+    # RFM and the time series both roll up from that result
+    keys = ['User_ID', 'Date'] if 'Date' in rows.columns else ['User_ID']
+    customer_days = rows.groupby(keys, sort=False, dropna=False)[['Orders', 'Amount']].sum()
+    rfm = customer_days.groupby(level='User_ID').sum().rename(columns={'Orders': 'Frequency', 'Amount': 'Monetary'})
+    
+    monthly_sales = daily_sales = None
+    if 'Date' in rows.columns:
+        # Recency counts days from a customer's last purchase to the latest purchase in the selection
+        dates = customer_days.index.get_level_values('Date')
+        last_purchase = pd.Series(dates, index=customer_days.index.get_level_values('User_ID')).groupby(level='User_ID').max()
+        rfm.insert(0, 'Recency', (dates.max() - last_purchase).dt.days)
+        
+        daily = customer_days.groupby(level='Date')['Amount'].sum()
+        months = pd.Categorical(daily.index.month_name(), categories=MONTH_ORDER, ordered=True)
+        monthly_sales = daily.groupby(months, observed=True).sum().rename_axis('Month').reset_index()
+        daily_sales = daily.reset_index()
     
-    return feature_importance
+    return CustomerAggregates(rfm=rfm, monthly_sales=monthly_sales, daily_sales=daily_sales)
+
+def histogram_bins(values, bins=RFM_HISTOGRAM_BINS, prefix=''):
+    # Binned here so the browser gets one bar per bin rather than one value per customer
+    values = np.asarray(values)
+    if len(values) and np.issubdtype(values.dtype, np.integer) and values.max() - values.min() < bins:
+        edges = np.arange(values.min(), values.max() + 2) - 0.5
+        labels = [f"{prefix}{edge + 0.5:,.0f}" for edge in edges[:-1]]
+    else:
+        edges = np.histogram_bin_edges(values, bins=bins)
+        labels = [f"{prefix}{lo:,.0f}–{prefix}{hi:,.0f}" for lo, hi in zip(edges[:-1], edges[1:])]
+    counts, edges = np.histogram(values, bins=edges)
+    return counts, edges, labels
+
+# Random Forest model for feature importance; the engines live in importance.py
+def segment_importance(model, rows):
+    # Permutation importance of the one trained model on a segment's rows, scored on all cores;
+    # a feature held constant by the filters (e.g. a single State) correctly scores zero
+    if len(rows) > SEGMENT_IMPORTANCE_ROWS:
+        rows = rows.sample(n=SEGMENT_IMPORTANCE_ROWS, random_state=42)
+    importances = permutation_importance(
+        model, encode_features(rows), rows['Amount'], n_repeats=5, random_state=42, n_jobs=-1
+    ).importances_mean.clip(min=0)
+    importances = importances / importances.sum() if importances.sum() > 0 else importances
+    feature_importance = pd.DataFrame({'Feature': MODEL_FEATURES, 'Importance': importances})
+    return feature_importance.sort_values('Importance', ascending=False)
+
+def measure_in_worker(data, config):
+    # One fresh interpreter per mode, so its peak memory excludes the server and other sessions.
+    # Streamlit runs this script as __main__, which multiprocessing's spawn would re-run in the child,
+    # so the worker is started as `python -m importance` and exchanges pickles through a temp dir
+    with tempfile.TemporaryDirectory() as tmp:
+        job_path, result_path = os.path.join(tmp, 'job.pkl'), os.path.join(tmp, 'result.pkl')
+        pd.to_pickle((data, config), job_path)
+        worker = subprocess.run([sys.executable, '-m', 'importance', job_path, result_path],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        if worker.returncode != 0:
+            lines = worker.stderr.strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else f"importance worker exited with code {worker.returncode}")
+        return pd.read_pickle(result_path)
+
+def compare_importance_modes(data):
+    # Reference forest versus the scalable modes: rank stability, training time and peak memory
+    modes = {
+        'Random forest (full)': dict(mode='rf', sample=1.0, max_depth=None),
+        'Random forest (20% sample, depth 12)': dict(mode='rf', sample=0.2, max_depth=12),
+        'Histogram boosting': dict(mode='hgb', sample=1.0, max_depth=None),
+        'Histogram boosting (20% sample, depth 8)': dict(mode='hgb', sample=0.2, max_depth=8),
+    }
+    # Only the model's columns are sent, as a plain DataFrame the worker can unpickle
+    columns = data[MODEL_FEATURES + ['Amount']]
+    runs = {name: measure_in_worker(columns, config) for name, config in modes.items()}
+    reference = runs['Random forest (full)']['feature_importance'].set_index('Feature')['Importance']
+    rows = []
+    for name, run in runs.items():
+        importance = run['feature_importance'].set_index('Feature')['Importance'].reindex(reference.index)
+        rows.append({
+            'Mode': name,
+            'Rank correlation vs full forest': importance.corr(reference, method='spearman'),
+            'Top feature': run['feature_importance']['Feature'].iloc[0],
+            'Training time (s)': run['train_seconds'],
+            'Importance scoring (s)': run['importance_seconds'],
+            'Peak memory (MB)': run['peak_memory_mb']
+        })
+    return pd.DataFrame(rows)
+
+def model_artifact_path(fingerprint):
+    # The engine configuration is part of the version stamp
+    return os.path.join(CACHE_DIR, f"rf_model_{fingerprint}_{IMPORTANCE_MODE}_{IMPORTANCE_SAMPLE:g}_{IMPORTANCE_MAX_DEPTH}.joblib")
+
+def load_or_train_rf_model(data, fingerprint):
+    # Restarts reload the persisted artifact; the fingerprint in its name is the version stamp
+    path = model_artifact_path(fingerprint)
+    if os.path.exists(path):
+        return joblib.load(path)
+    
+    artifact = train_importance_model(data, IMPORTANCE_MODE, IMPORTANCE_SAMPLE, IMPORTANCE_MAX_DEPTH)
+    artifact.update(fingerprint=fingerprint, trained_at=time.time())
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(artifact, tmp_path)
+    os.replace(tmp_path, path)
+    
+    # Drop artifacts trained on older versions of the dataset
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith('rf_model_') and name.endswith('.joblib') and name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+            except FileNotFoundError:
+                pass
+    return artifact
 
-# Only train if we have sufficient data
+@st.cache_resource
+def get_background_jobs():
+    # One worker per process for model training and one for query refinement, so an exact cube never
+    # queues behind a forest fit; jobs are shared by every session
+    executors = {'model': ThreadPoolExecutor(max_workers=1), 'query': ThreadPoolExecutor(max_workers=1)}
+    return executors, {}, threading.Lock()
+
+def submit_job(key, fn, *args, pool='model'):
+    # Starts fn once per key on the pool's shared worker and returns its Future
+    executors, jobs, lock = get_background_jobs()
+    with lock:
+        if key not in jobs:
+            jobs[key] = executors[pool].submit(fn, *args)
+        return jobs[key]
+
+def background_job(key, fn, *args, pool='model'):
+    # Returns fn's result, or None while it is still running. A failed job is dropped so the next
+    # call retries it, and its exception is raised to this caller alone
+    job = submit_job(key, fn, *args, pool=pool)
+    if not job.done():
+        return None
+    if job.exception() is not None:
+        executors, jobs, lock = get_background_jobs()
+        with lock:
+            if jobs.get(key) is job:
+                del jobs[key]
+        raise job.exception()
+    return job.result()
+
+def rf_model_key(fingerprint):
+    return ('model', model_artifact_path(fingerprint))
+
+def request_rf_model(data, fingerprint):
+    return background_job(rf_model_key(fingerprint), load_or_train_rf_model, data, fingerprint)
+
+def scenario_grid(classes, choices, orders):
+    # Cartesian product of the chosen values as model inputs, built from category codes without a Python loop
+    axes = [classes[col].get_indexer(choices[col]) for col in CATEGORICAL_FEATURES]
+    axes.append(np.arange(orders[0], orders[1] + 1))
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(MODEL_FEATURES))
+    return pd.DataFrame(grid, columns=MODEL_FEATURES)
+
+def score_scenarios(artifact, choices, orders):
+    # One batched predict over the whole grid; labels are decoded back from the codes for display
+    grid = scenario_grid(artifact['classes'], choices, orders)
+    scenarios = pd.DataFrame({
+        col: pd.Categorical.from_codes(grid[col].to_numpy(), artifact['classes'][col]) if col in CATEGORICAL_FEATURES else grid[col]
+        for col in MODEL_FEATURES
+    })
+    scenarios['Predicted_Amount'] = artifact['model'].predict(grid)
+    return scenarios
+
+# Only train if we have sufficient data; training starts before the page renders. Only the model
+# section reads the result, so a failed fit is reported there instead of stopping the whole page
 if len(df) > 100:
-    rf_feature_importance = train_rf_model(df)
-else:
-    rf_feature_importance = None
+    submit_job(rf_model_key(df.attrs['fingerprint']), load_or_train_rf_model, df, df.attrs['fingerprint'])
+
+# Approximate mode reads the sample cube until a refine job has built the exact cube for every session
+EXACT_CUBE_JOB = ('exact_cube', data_version)
+exact_cube_error = None
+if cube is None and EXACT_CUBE_JOB in get_background_jobs()[1]:
+    try:
+        cube = background_job(EXACT_CUBE_JOB, aggregate_cube, df, pool='query')
+    except Exception as e:
+        exact_cube_error = e
+approximate = cube is None
+query_cube = sample_cube if approximate else cube
 
 # Streamlit app
 st.markdown('<div class="stHeader"><h1>✨ Diwali Sales Analysis Dashboard ✨</h1></div>', unsafe_allow_html=True)
@@ -760,341 +1621,576 @@ st.sidebar.markdown("---")
 
 # Sidebar filters with enhanced styling
 st.sidebar.markdown("### 🔍 Filter Data")
-gender_filter = st.sidebar.multiselect(
-    "Gender",
-    options=df['Gender'].unique(),
-    default=df['Gender'].unique(),
-    key="gender_filter"
+batch_filters = st.sidebar.checkbox(
+    "Apply filters in batches",
+    key="batch_filters",
+    help="Collect several filter changes and recompute the dashboard once, when applied or after a short pause"
 )
 
-age_filter = st.sidebar.multiselect(
-    "Age Group",
-    options=df['Age_Category'].unique(),
-    default=df['Age_Category'].unique(),
-    key="age_filter"
-)
+def filter_widgets(on_change=None):
+    return {
+        col: st.multiselect(
+            label,
+            options=df[col].unique().tolist(),
+            default=df[col].unique().tolist(),
+            key=key,
+            on_change=on_change
+        )
+        for col, (label, key) in FILTER_WIDGETS.items()
+    }
 
-state_filter = st.sidebar.multiselect(
-    "State",
-    options=df['State'].unique(),
-    default=df['State'].unique(),
-    key="state_filter"
-)
+def mark_filter_edit():
+    st.session_state['filter_edited_at'] = time.monotonic()
+
+def pending_filters():
+    return {col: st.session_state[key] for col, (label, key) in FILTER_WIDGETS.items()}
+
+def filters_settled():
+    return (FILTER_DEBOUNCE_SECONDS > 0 and
+            time.monotonic() - st.session_state.get('filter_edited_at', 0) >= FILTER_DEBOUNCE_SECONDS)
 
-# Apply filters
-filtered_df = df[
-    (df['Gender'].isin(gender_filter)) &
-    (df['Age_Category'].isin(age_filter)) &
-    (df['State'].isin(state_filter))
-]
+def apply_when_settled():
+    # Ticks alone, without rebuilding the widgets, until the pending edit settles; applying reruns
+    # the whole app, which stops the timer
+    pending = pending_filters()
+    if selection_key(pending) != selection_key(st.session_state['applied_filters']) and filters_settled():
+        st.session_state['applied_filters'] = pending
+        st.rerun()
+
+@st.fragment
+def filter_panel():
+    # Edits rerun only this panel; the dashboard reruns once per applied selection
+    pending = filter_widgets(on_change=mark_filter_edit)
+    applied = st.session_state.setdefault('applied_filters', pending)
+    changed = selection_key(pending) != selection_key(applied)
+    st.caption(f"Pending selection covers {count_rows(filter_index, pending):,} of {len(df):,} rows")
+    
+    if st.button("Apply filters", key="apply_filters", disabled=not changed) or (changed and filters_settled()):
+        st.session_state['applied_filters'] = pending
+        st.rerun()
+    # The debounce timer exists only while an edit is pending, not for the life of the session
+    if changed and FILTER_DEBOUNCE_SECONDS > 0:
+        st.fragment(run_every=FILTER_DEBOUNCE_SECONDS)(apply_when_settled)()
+
+with st.sidebar:
+    if batch_filters:
+        filter_panel()
+    else:
+        st.session_state['applied_filters'] = filter_widgets()
+
+# Load and memory report
+performance_panel = st.sidebar.expander("⚙️ Performance")
+with performance_panel:
+    load_report = df.attrs.get('load_report', {})
+    if load_report:
+        st.write(f"Memory: {load_report['memory_before_mb']:.1f} MB → {load_report['memory_after_mb']:.1f} MB "
+                 f"({load_report['memory_before_mb'] / load_report['memory_after_mb']:.1f}x smaller)")
+        if load_report.get('peak_rss_mb'):
+            mode = f"chunks of {load_report['chunksize']:,} rows" if load_report.get('chunksize') else f"{load_report['engine']} parser"
+            st.write(f"Peak RSS during ingestion ({mode}): {load_report['peak_rss_mb']:.0f} MB")
+        if load_report.get('peak_private_mb'):
+            st.write(f"Peak private memory during chunked ingestion: {load_report['peak_private_mb']:.0f} MB")
+    worker_memory = process_memory_mb()
+    if worker_memory:
+        st.write(f"Worker {os.getpid()} RSS: {worker_memory['VmRSS']:.0f} MB "
+                 f"({worker_memory['RssAnon']:.0f} MB private, {worker_memory['RssFile']:.0f} MB shared file pages)")
+
+# Apply filters; charts read the matching cube cells, only per-customer sections need raw rows
+filters = st.session_state['applied_filters']
+filter_key = selection_key(filters)
+cube_selection = query_cube[np.logical_and.reduce([query_cube[col].isin(selected) for col, selected in filters.items()])]
+
+selection_frames = {}
+def selected_positions():
+    # Gathered at most once per rerun, and only when a section's result is not cached
+    if 'positions' not in selection_frames:
+        selection_frames['positions'] = select_rows(filter_index, filters, len(df))
+    return selection_frames['positions']
+
+def filtered_rows():
+    if 'rows' not in selection_frames:
+        selection_frames['rows'] = df.take(selected_positions())
+    return selection_frames['rows']
+
+def cached_section(section, compute):
+    return result_cache.get_or_compute((section, data_version, filter_key, approximate), compute)
+
+# Each section declares the sidebar filters it reads. Its figures are rebuilt only when those filters
+# change, and widgets inside a section rerun that section alone as a fragment
+SECTION_INPUTS = {
+    'demographics': FILTER_COLUMNS,
+    'geography': FILTER_COLUMNS,
+    'products': FILTER_COLUMNS,
+    'model': (),
+    'model_segment': FILTER_COLUMNS,
+    'time': FILTER_COLUMNS,
+    'segmentation': FILTER_COLUMNS,
+}
+
+def section_output(section, build):
+    inputs = selection_key({col: filters[col] for col in SECTION_INPUTS[section]})
+    return result_cache.get_or_compute(('section', section, data_version, inputs, approximate), build)
+
+# Hover text for pie slices whose values carry a sampled confidence interval
+INTERVAL_HOVER = '%{label}: %{value:,.0f} ± %{customdata:,.0f} (95%)<extra></extra>'
+
+def poll_job(key, message):
+    # Run as a timed fragment while a background job is pending: shows message between ticks and reruns
+    # the app once the job finishes, so its result (or error) replaces the placeholder
+    job = get_background_jobs()[1].get(key)
+    if job is None or job.done():
+        st.rerun()
+    st.info(message)
+
+def refine_panel():
+    # Polls while the exact cube is built on the shared worker; a full rerun then swaps it in
+    job = get_background_jobs()[1].get(EXACT_CUBE_JOB)
+    if job is not None and job.done():
+        st.rerun()
+    sampled_rows = int(sample_cube['Rows_n'].sum())
+    st.info(f"Approximate answers from a stratified sample of {sampled_rows:,} rows "
+            f"({sampled_rows / len(df):.1%}); ± values are 95% confidence intervals")
+    if exact_cube_error is not None:
+        st.error(f"Computing exact answers failed: {exact_cube_error}")
+    if job is None:
+        if st.button("Refine to exact", key="refine_exact"):
+            background_job(EXACT_CUBE_JOB, aggregate_cube, df, pool='query')
+            st.rerun()
+    else:
+        st.caption("Computing exact answers in the background…")
 
 # KPI Cards with enhanced styling
-st.markdown('<div class="section-header"><h2>📊 Key Performance Indicators</h2></div>', unsafe_allow_html=True)
-col1, col2, col3, col4 = st.columns(4)
-with col1:
-    st.metric("Total Revenue", f"₹{filtered_df['Amount'].sum():,}")
-with col2:
-    st.metric("Total Orders", filtered_df['Orders'].sum())
-with col3:
-    st.metric("Average Spending", f"₹{filtered_df['Amount'].mean():,.0f}")
-with col4:
-    st.metric("Unique Customers", filtered_df['User_ID'].nunique())
+@st.fragment
+def kpi_section():
+    st.markdown('<div class="section-header"><h2>📊 Key Performance Indicators</h2></div>', unsafe_allow_html=True)
+    exact = st.toggle("Exact unique customers", key="exact_customers",
+                      help="Count customers over the selected rows instead of merging per-cell sketches")
+    if not exact:
+        kpis = cached_section('kpis_sketch', lambda: kpi_aggregates(
+            cube_selection, sketch_customers(customer_sketches, filters)
+        ))
+    elif KPI_MAINTENANCE == 'delta':
+        kpis = maintain_kpis(customer_codes, filters)
+    else:
+        kpis = cached_section('kpis', lambda: kpi_aggregates(
+            cube_selection, distinct_customers(customer_codes, selected_positions())
+        ))
+    # Row-level delta totals are exact even in approximate mode
+    sampled = approximate and not (exact and KPI_MAINTENANCE == 'delta')
+    intervals = cached_section('kpi_intervals', lambda: {
+        'revenue': sample_interval(cube_selection),
+        'orders': sample_interval(cube_selection, column='Orders'),
+        'avg_spending': ratio_interval(cube_selection)
+    }) if sampled else None
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Total Revenue", f"≈₹{kpis['revenue']:,.0f}" if sampled else f"₹{kpis['revenue']:,}")
+        if sampled:
+            st.caption(f"±₹{intervals['revenue']:,.0f} (95%)")
+    with col2:
+        st.metric("Total Orders", f"≈{kpis['orders']:,.0f}" if sampled else kpis['orders'])
+        if sampled:
+            st.caption(f"±{intervals['orders']:,.0f} (95%)")
+    with col3:
+        st.metric("Average Spending", f"{'≈' if sampled else ''}₹{kpis['avg_spending']:,.0f}")
+        if sampled:
+            st.caption(f"±₹{intervals['avg_spending']:,.0f} (95%)")
+    with col4:
+        st.metric("Unique Customers", kpis['customers'] if exact else f"≈{kpis['customers']:,}")
+        if not exact:
+            # Standard error of HyperLogLog is 1.04 / sqrt(registers); two of them cover ~95%
+            st.caption(f"±{2 * 1.04 / np.sqrt(1 << HLL_PRECISION):.1%} (95%), from per-cell sketches")
+
+kpi_section()
+if approximate:
+    st.fragment(run_every=2 if EXACT_CUBE_JOB in get_background_jobs()[1] else None)(refine_panel)()
 
 # Demographic Analysis
-st.markdown('<div class="section-header"><h2>👥 Demographic Analysis</h2></div>', unsafe_allow_html=True)
-demog1, demog2 = st.columns(2)
-
-with demog1:
-    # Gender distribution
-    gender_counts = filtered_df['Gender'].value_counts()
-    gender_amount = filtered_df.groupby('Gender')['Amount'].sum()
-    
-    fig = make_subplots(rows=1, cols=2, 
-                       specs=[[{"type": "pie"}, {"type": "pie"}]],
-                       subplot_titles=('Customer Distribution', 'Revenue Contribution'))
-    
-    fig.add_trace(go.Pie(
-        labels=gender_counts.index, 
-        values=gender_counts.values, 
-        name="Distribution", 
-        hole=0.4, 
-        marker_colors=['#FF9999','#66B2FF']
-    ), row=1, col=1)
-    
-    fig.add_trace(go.Pie(
-        labels=gender_amount.index, 
-        values=gender_amount.values, 
-        name="Revenue", 
-        hole=0.4, 
-        marker_colors=['#FF9999','#66B2FF']
-    ), row=1, col=2)
-    
-    fig.update_layout(height=400, showlegend=False, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-    st.plotly_chart(fig, use_container_width=True)
+@st.fragment
+def demographic_section():
+    st.markdown('<div class="section-header"><h2>👥 Demographic Analysis</h2></div>', unsafe_allow_html=True)
+    
+    def build():
+        gender_counts, gender_amount, age_group = demographic_aggregates(cube_selection)
+        if approximate:
+            count_interval = sample_interval(cube_selection, 'Gender', None).reindex(gender_counts.index).to_numpy()
+            amount_interval = sample_interval(cube_selection, 'Gender').reindex(gender_amount.index).to_numpy()
+            age_interval = sample_interval(cube_selection, 'Age_Category').reindex(age_group['Age_Category']).to_numpy()
+        
+        # Gender distribution
+        gender_fig = make_subplots(rows=1, cols=2,
+                                   specs=[[{"type": "pie"}, {"type": "pie"}]],
+                                   subplot_titles=('Customer Distribution', 'Revenue Contribution'))
+        
+        gender_fig.add_trace(go.Pie(
+            labels=gender_counts.index,
+            values=gender_counts.values,
+            name="Distribution",
+            hole=0.4,
+            marker_colors=['#FF9999','#66B2FF'],
+            customdata=count_interval if approximate else None,
+            hovertemplate=INTERVAL_HOVER if approximate else None
+        ), row=1, col=1)
+        
+        gender_fig.add_trace(go.Pie(
+            labels=gender_amount.index,
+            values=gender_amount.values,
+            name="Revenue",
+            hole=0.4,
+            marker_colors=['#FF9999','#66B2FF'],
+            customdata=amount_interval if approximate else None,
+            hovertemplate=INTERVAL_HOVER if approximate else None
+        ), row=1, col=2)
+        
+        gender_fig.update_layout(height=400, showlegend=False, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+        
+        # Age group analysis
+        age_fig = go.Figure()
+        age_fig.add_trace(go.Bar(
+            x=age_group['Age_Category'],
+            y=age_group['Revenue'],
+            name='Revenue',
+            marker_color='#1f77b4',
+            text=[f'₹{x/1000000:.1f}M' for x in age_group['Revenue']],
+            textposition='auto',
+            error_y=dict(type='data', array=age_interval) if approximate else None
+        ))
+        
+        age_fig.update_layout(
+            title='Revenue by Age Group',
+            xaxis_title='Age Group',
+            yaxis_title='Revenue (₹)',
+            height=400,
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='white')
+        )
+        return gender_fig, age_fig
+    
+    gender_fig, age_fig = section_output('demographics', build)
+    demog1, demog2 = st.columns(2)
+    with demog1:
+        st.plotly_chart(gender_fig, use_container_width=True)
+    with demog2:
+        st.plotly_chart(age_fig, use_container_width=True)
 
-with demog2:
-    # Age group analysis
-    age_group = filtered_df.groupby('Age_Category').agg(
-        Customers=('User_ID', 'count'),
-        Revenue=('Amount', 'sum'),
-    ).reset_index().sort_values('Revenue', ascending=False)
-    
+
+# Geographic Analysis
+@st.cache_resource
+def get_india_geojson():
+    url = "https://gist.githubusercontent.com/jbrobst/56c13bbbf9d97d187fea01ca62ea5112/raw/e388c4cae20aa53cb5090210a42ebb9b765c0a36/india_states.geojson"
+    response = requests.get(url)
+    return response.json()
+
+def state_map_figure(india_geojson, state_revenue):
+    # Create enhanced choropleth map
     fig = go.Figure()
-    fig.add_trace(go.Bar(
-        x=age_group['Age_Category'], 
-        y=age_group['Revenue'],
-        name='Revenue',
-        marker_color='#1f77b4',
-        text=[f'₹{x/1000000:.1f}M' for x in age_group['Revenue']],
-        textposition='auto'
+    
+    # Base layer with 3D effect
+    fig.add_trace(go.Choropleth(
+        locations=state_revenue['State'],
+        z=state_revenue['Amount'],
+        featureidkey='properties.ST_NM',
+        colorscale='OrRd',
+        marker_line_width=1.5,
+        marker_line_color='rgba(255, 255, 255, 0.9)',
+        hoverinfo='text',
+        hovertext=state_revenue.apply(lambda row: f"<b>{row['State']}</b><br>Revenue: ₹{row['Amount']:,.0f}"
+                                      + (f" ± ₹{row['Interval']:,.0f}" if 'Interval' in row else ''), axis=1),
+        showscale=True,
+        zmin=state_revenue['Amount'].min(),
+        zmax=state_revenue['Amount'].max()
     ))
     
+    # Enhance map styling
+    fig.update_geos(
+        visible=True,
+        resolution=50,
+        showcountries=True,
+        countrycolor="White",
+        countrywidth=0.8,
+        showsubunits=True,
+        subunitcolor="rgba(255, 255, 255, 0.3)",
+        subunitwidth=0.5,
+        showocean=True,
+        oceancolor="#0c0520",
+        showlakes=True,
+        lakecolor="#0c0520",
+        showrivers=True,
+        rivercolor="#0c0520",
+        bgcolor='rgba(0,0,0,0)',
+        landcolor='rgba(50, 50, 50, 0.3)',
+        projection_type="orthographic"
+    )
+    
+    # Add glow effect to map
     fig.update_layout(
-        title='Revenue by Age Group',
-        xaxis_title='Age Group',
-        yaxis_title='Revenue (₹)',
-        height=400,
+        height=500,
+        geo=dict(
+            landcolor='rgba(0, 0, 0, 0.2)',
+            showland=True,
+            center=dict(lat=22, lon=78),
+            projection_scale=5
+        ),
+        coloraxis_colorbar=dict(
+            title="Revenue (₹)",
+            thickness=15,
+            len=0.7,
+            bgcolor='rgba(0,0,0,0.3)',
+            tickfont=dict(color='white'),
+            titlefont=dict(color='white'),
+            ticksuffix="K",
+            tickformat=",.0f"
+        ),
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='white')
+        font=dict(color='white'),
+        margin=dict(l=0, r=0, t=40, b=0),
+        hoverlabel=dict(
+            bgcolor="rgba(0, 0, 0, 0.8)",
+            font_size=14,
+            font_color="white",
+            bordercolor="#FFD700"
+        ),
+        title=dict(
+            text="Revenue Distribution by State",
+            font=dict(size=20, color="#FFD700"),
+            x=0.5,
+            y=0.95,
+            xanchor='center',
+            yanchor='top'
+        ),
+        # Add zoom controls
+        updatemenus=[
+            dict(
+                type="buttons",
+                showactive=False,
+                direction="right",
+                x=0.5,
+                y=-0.1,
+                xanchor="center",
+                buttons=list([
+                    dict(
+                        args=[{"geo.projection.type": "mercator"}],
+                        label="2D Map",
+                        method="relayout"
+                    ),
+                    dict(
+                        args=[{"geo.projection.type": "orthographic"}],
+                        label="3D Globe",
+                        method="relayout"
+                    ),
+                    dict(
+                        args=[{"geo.projection.type": "natural earth"}],
+                        label="Earth View",
+                        method="relayout"
+                    )
+                ])
+            )
+        ]
     )
-    st.plotly_chart(fig, use_container_width=True)
-
-# Geographic Analysis
-st.markdown('<div class="section-header"><h2>🗺️ Geographic Analysis</h2></div>', unsafe_allow_html=True)
-geo1, geo2 = st.columns(2)
-
-with geo1:
-    # Top states
-    state_analysis = filtered_df.groupby('State').agg(
-        Revenue=('Amount', 'sum'),
-        Avg_Spending=('Amount', 'mean')
-    ).sort_values('Revenue', ascending=False).head(10)
     
-    fig = go.Figure()
-    fig.add_trace(go.Bar(
-        x=state_analysis.index,
-        y=state_analysis['Revenue'],
-        name='Revenue',
-        marker_color='#2ca02c',
-        text=[f'₹{x/1000000:.1f}M' for x in state_analysis['Revenue']],
-        textposition='auto'
+    # Add state boundaries as separate trace
+    fig.add_trace(go.Scattergeo(
+        locations=state_revenue['State'],
+        featureidkey="properties.ST_NM",
+        mode="text",
+        text=state_revenue['State'],
+        textposition="middle center",
+        textfont=dict(color="white", size=9),
+        hoverinfo='none',
+        showlegend=False
     ))
     
-    fig.update_layout(
-        title='Top States by Revenue',
-        xaxis_title='State',
-        yaxis_title='Revenue (₹)',
-        height=400,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='white')
-    )
-    st.plotly_chart(fig, use_container_width=True)
-
-# ... [rest of the code remains the same] ...
+    # Assigned after add_trace, plotly keeps a reference to the shared GeoJSON instead of deep-copying it
+    # per trace, so the map is cheap to rebuild from the cached state_revenue on every run
+    for trace in fig.data:
+        trace.geojson = india_geojson
+    return fig
 
-with geo2:
-    # Enhanced state map with 3D effect and glow
-    try:
-        # Get India GeoJSON data
-        @st.cache_data
-        def get_india_geojson():
-            url = "https://gist.githubusercontent.com/jbrobst/56c13bbbf9d97d187fea01ca62ea5112/raw/e388c4cae20aa53cb5090210a42ebb9b765c0a36/india_states.geojson"
-            response = requests.get(url)
-            return response.json()
-        
-        india_geojson = get_india_geojson()
-        
-        state_revenue = filtered_df.groupby('State')['Amount'].sum().reset_index()
-        
-        # Create enhanced choropleth map
+@st.fragment
+def geographic_section():
+    st.markdown('<div class="section-header"><h2>🗺️ Geographic Analysis</h2></div>', unsafe_allow_html=True)
+    geo1, geo2 = st.columns(2)
+    state_analysis, state_revenue = cached_section('geography', lambda: geographic_aggregates(cube_selection))
+    if approximate:
+        state_interval = sample_interval(cube_selection, 'State')
+        state_revenue = state_revenue.assign(Interval=state_interval.reindex(state_revenue['State']).to_numpy())
+    
+    def build():
+        # Top states
         fig = go.Figure()
-        
-        # Base layer with 3D effect
-        fig.add_trace(go.Choropleth(
-            geojson=india_geojson,
-            locations=state_revenue['State'],
-            z=state_revenue['Amount'],
-            featureidkey='properties.ST_NM',
-            colorscale='OrRd',
-            marker_line_width=1.5,
-            marker_line_color='rgba(255, 255, 255, 0.9)',
-            hoverinfo='text',
-            hovertext=state_revenue.apply(lambda row: f"<b>{row['State']}</b><br>Revenue: ₹{row['Amount']:,.0f}", axis=1),
-            showscale=True,
-            zmin=state_revenue['Amount'].min(),
-            zmax=state_revenue['Amount'].max()
+        fig.add_trace(go.Bar(
+            x=state_analysis.index,
+            y=state_analysis['Revenue'],
+            name='Revenue',
+            marker_color='#2ca02c',
+            text=[f'₹{x/1000000:.1f}M' for x in state_analysis['Revenue']],
+            textposition='auto',
+            error_y=dict(type='data', array=state_interval.reindex(state_analysis.index).to_numpy()) if approximate else None
         ))
         
-        # Enhance map styling
-        fig.update_geos(
-            visible=True,
-            resolution=50,
-            showcountries=True,
-            countrycolor="White",
-            countrywidth=0.8,
-            showsubunits=True,
-            subunitcolor="rgba(255, 255, 255, 0.3)",
-            subunitwidth=0.5,
-            showocean=True,
-            oceancolor="#0c0520",
-            showlakes=True,
-            lakecolor="#0c0520",
-            showrivers=True,
-            rivercolor="#0c0520",
-            bgcolor='rgba(0,0,0,0)',
-            landcolor='rgba(50, 50, 50, 0.3)',
-            projection_type="orthographic"
+        fig.update_layout(
+            title='Top States by Revenue',
+            xaxis_title='State',
+            yaxis_title='Revenue (₹)',
+            height=400,
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='white')
         )
+        return fig
+    
+    with geo1:
+        st.plotly_chart(section_output('geography', build), use_container_width=True)
+    
+    with geo2:
+        # Enhanced state map with 3D effect and glow; a failed GeoJSON fetch is retried on the next run
+        try:
+            india_geojson = get_india_geojson()
+            fig = state_map_figure(india_geojson, state_revenue)
+            
+            # Display the map
+            st.plotly_chart(fig, use_container_width=True, config={
+                'displayModeBar': True,
+                'scrollZoom': True,
+                'modeBarButtonsToAdd': ['zoomInGeo', 'zoomOutGeo', 'resetGeo']
+            })
         
-        # Add glow effect to map
-        fig.update_layout(
+        except Exception as e:
+            st.warning(f"Map visualization not available: {str(e)}")
+
+
+# Product Analysis
+@st.fragment
+def product_section():
+    st.markdown('<div class="section-header"><h2>📦 Product Analysis</h2></div>', unsafe_allow_html=True)
+    
+    def build():
+        product_analysis, spending_segments = product_aggregates(cube_selection)
+        if approximate:
+            product_interval = sample_interval(cube_selection, 'Product_Category').reindex(product_analysis.index).to_numpy()
+            segment_interval = sample_interval(cube_selection, 'Spending_Segment', None).reindex(spending_segments.index).fillna(0).to_numpy()
+        
+        # Top product categories
+        category_fig = go.Figure()
+        category_fig.add_trace(go.Bar(
+            y=product_analysis.index,
+            x=product_analysis['Revenue'],
+            name='Revenue',
+            marker_color='#9467bd',
+            orientation='h',
+            text=[f'₹{x/1000000:.1f}M' for x in product_analysis['Revenue']],
+            textposition='auto',
+            error_x=dict(type='data', array=product_interval) if approximate else None
+        ))
+        
+        category_fig.update_layout(
+            title='Top Product Categories by Revenue',
+            xaxis_title='Revenue (₹)',
+            yaxis_title='Product Category',
             height=500,
-            geo=dict(
-                landcolor='rgba(0, 0, 0, 0.2)',
-                showland=True,
-                center=dict(lat=22, lon=78),
-                projection_scale=5
-            ),
-            coloraxis_colorbar=dict(
-                title="Revenue (₹)",
-                thickness=15,
-                len=0.7,
-                bgcolor='rgba(0,0,0,0.3)',
-                tickfont=dict(color='white'),
-                titlefont=dict(color='white'),
-                ticksuffix="K",
-                tickformat=",.0f"
-            ),
             paper_bgcolor='rgba(0,0,0,0)',
             plot_bgcolor='rgba(0,0,0,0)',
-            font=dict(color='white'),
-            margin=dict(l=0, r=0, t=40, b=0),
-            hoverlabel=dict(
-                bgcolor="rgba(0, 0, 0, 0.8)",
-                font_size=14,
-                font_color="white",
-                bordercolor="#FFD700"
-            ),
-            title=dict(
-                text="Revenue Distribution by State",
-                font=dict(size=20, color="#FFD700"),
-                x=0.5,
-                y=0.95,
-                xanchor='center',
-                yanchor='top'
-            ),
-            # Add zoom controls
-            updatemenus=[
-                dict(
-                    type="buttons",
-                    showactive=False,
-                    direction="right",
-                    x=0.5,
-                    y=-0.1,
-                    xanchor="center",
-                    buttons=list([
-                        dict(
-                            args=[{"geo.projection.type": "mercator"}],
-                            label="2D Map",
-                            method="relayout"
-                        ),
-                        dict(
-                            args=[{"geo.projection.type": "orthographic"}],
-                            label="3D Globe",
-                            method="relayout"
-                        ),
-                        dict(
-                            args=[{"geo.projection.type": "natural earth"}],
-                            label="Earth View",
-                            method="relayout"
-                        )
-                    ])
-                )
-            ]
+            font=dict(color='white')
         )
         
-        # Add state boundaries as separate trace
-        fig.add_trace(go.Scattergeo(
-            geojson=india_geojson,
-            locations=state_revenue['State'],
-            featureidkey="properties.ST_NM",
-            mode="text",
-            text=state_revenue['State'],
-            textposition="middle center",
-            textfont=dict(color="white", size=9),
-            hoverinfo='none',
-            showlegend=False
+        # Spending segments
+        segment_fig = go.Figure()
+        segment_fig.add_trace(go.Pie(
+            labels=spending_segments.index,
+            values=spending_segments.values,
+            hole=0.3,
+            marker_colors=px.colors.sequential.RdBu,
+            customdata=segment_interval if approximate else None,
+            hovertemplate=INTERVAL_HOVER if approximate else None
         ))
         
-        # Display the map
-        st.plotly_chart(fig, use_container_width=True, config={
-            'displayModeBar': True,
-            'scrollZoom': True,
-            'modeBarButtonsToAdd': ['zoomInGeo', 'zoomOutGeo', 'resetGeo']
-        })
-        
-    except Exception as e:
-        st.warning(f"Map visualization not available: {str(e)}")
+        segment_fig.update_layout(
+            title='Customer Spending Segments',
+            height=500,
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='white')
+        )
+        return category_fig, segment_fig
+    
+    category_fig, segment_fig = section_output('products', build)
+    prod1, prod2 = st.columns(2)
+    with prod1:
+        st.plotly_chart(category_fig, use_container_width=True)
+    with prod2:
+        st.plotly_chart(segment_fig, use_container_width=True)
 
-# Product Analysis
-st.markdown('<div class="section-header"><h2>📦 Product Analysis</h2></div>', unsafe_allow_html=True)
-prod1, prod2 = st.columns(2)
-
-with prod1:
-    # Top product categories
-    product_analysis = filtered_df.groupby('Product_Category').agg(
-        Orders=('Orders', 'sum'),
-        Revenue=('Amount', 'sum')
-    ).sort_values('Revenue', ascending=False).head(10)
-    
-    fig = go.Figure()
-    fig.add_trace(go.Bar(
-        y=product_analysis.index,
-        x=product_analysis['Revenue'],
-        name='Revenue',
-        marker_color='#9467bd',
+
+# Random Forest Insights Section
+def importance_figure(feature_importance, title):
+    # Feature importance visualization
+    fig = px.bar(
+        feature_importance,
+        x='Importance',
+        y='Feature',
         orientation='h',
-        text=[f'₹{x/1000000:.1f}M' for x in product_analysis['Revenue']],
-        textposition='auto'
-    ))
-    
+        title=title,
+        color='Importance',
+        color_continuous_scale='Bluered'
+    )
     fig.update_layout(
-        title='Top Product Categories by Revenue',
-        xaxis_title='Revenue (₹)',
-        yaxis_title='Product Category',
-        height=500,
+        height=400,
+        yaxis_title='Feature',
+        xaxis_title='Importance Score',
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
         font=dict(color='white')
     )
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
-with prod2:
-    # Spending segments
-    spending_segments = filtered_df['Spending_Segment'].value_counts().sort_index()
-    fig = go.Figure()
-    fig.add_trace(go.Pie(
-        labels=spending_segments.index,
-        values=spending_segments.values,
-        hole=0.3,
-        marker_colors=px.colors.sequential.RdBu
-    ))
-    
+def what_if_outputs(artifact, choices, orders):
+    # Scores the grid and reduces it to what the expander shows, so reruns reuse the summary
+    scenarios = score_scenarios(artifact, choices, orders)
+    by_category = group_agg(scenarios, 'Product_Category', Predicted_Amount=('Predicted_Amount', 'mean')).reset_index()
+    fig = px.bar(
+        by_category.sort_values('Predicted_Amount', ascending=False),
+        x='Product_Category',
+        y='Predicted_Amount',
+        title='Mean Predicted Amount by Product Category',
+        color='Predicted_Amount',
+        color_continuous_scale='Bluered'
+    )
     fig.update_layout(
-        title='Customer Spending Segments',
-        height=500,
+        height=400,
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
         font=dict(color='white')
     )
-    st.plotly_chart(fig, use_container_width=True)
-
-# Random Forest Insights Section
-st.markdown('<div class="section-header"><h2>🌳 Random Forest Insights</h2></div>', unsafe_allow_html=True)
+    return {
+        'count': len(scenarios),
+        'mean': scenarios['Predicted_Amount'].mean(),
+        'best': scenarios['Predicted_Amount'].max(),
+        'figure': fig,
+        'top': scenarios.nlargest(10, 'Predicted_Amount')
+    }
 
-if rf_feature_importance is not None:
+@st.fragment
+def model_section():
+    st.markdown('<div class="section-header"><h2>🌳 Random Forest Insights</h2></div>', unsafe_allow_html=True)
+    
+    # Requested here rather than at the top so the polling below refreshes this section alone
+    try:
+        rf_artifact = request_rf_model(df, df.attrs['fingerprint']) if len(df) > 100 else None
+    except Exception as e:
+        st.error(f"Training the Random Forest model failed: {e}")
+        st.button("Retry", key="rf_retry")
+        return
+    if len(df) > 100 and rf_artifact is None:
+        st.fragment(run_every=2)(poll_job)(rf_model_key(df.attrs['fingerprint']),
+            "🌳 Training the Random Forest model in the background… insights will appear when it finishes.")
+        return
+    if rf_artifact is None:
+        st.warning("Insufficient data to generate Random Forest insights")
+        return
+    
     # Create two columns for layout
     rf_col1, rf_col2 = st.columns([2, 3])
     
@@ -1114,119 +2210,227 @@ if rf_feature_importance is not None:
         """, unsafe_allow_html=True)
     
     with rf_col2:
-        # Feature importance visualization
-        fig = px.bar(
-            rf_feature_importance,
-            x='Importance',
-            y='Feature',
-            orientation='h',
-            title='Feature Importance in Sales Prediction',
-            color='Importance',
-            color_continuous_scale='Bluered'
-        )
-        fig.update_layout(
-            height=400,
-            yaxis_title='Feature',
-            xaxis_title='Importance Score',
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            font=dict(color='white')
-        )
+        # Importances for the whole dataset, or attributed to the filtered segment from the same model
+        fig = None
+        if st.checkbox("Reflect sidebar filters", key="rf_segment"):
+            if len(filtered_rows()) < 50:
+                st.warning("Too few rows in the current selection for segment importances; showing the full dataset")
+            else:
+                fig = section_output('model_segment', lambda: importance_figure(
+                    segment_importance(rf_artifact['model'], filtered_rows()),
+                    'Feature Importance in the Selected Segment'
+                ))
+        if fig is None:
+            fig = section_output('model', lambda: importance_figure(
+                rf_artifact['feature_importance'], 'Feature Importance in Sales Prediction'
+            ))
         st.plotly_chart(fig, use_container_width=True)
-else:
-    st.warning("Insufficient data to generate Random Forest insights")
+        st.caption(f"Engine: {rf_artifact['mode']} · sample {rf_artifact['sample']:.0%} · "
+                   f"max depth {rf_artifact['max_depth'] or 'unlimited'} · trained in {rf_artifact['train_seconds']:.1f}s")
+    
+    with st.expander("⚖️ Compare importance engines"):
+        comparison_key = ('importance_modes', df.attrs['fingerprint'])
+        jobs = get_background_jobs()[1]
+        if comparison_key in jobs or st.button("Run comparison", key="compare_importance"):
+            try:
+                comparison = background_job(comparison_key, compare_importance_modes, df)
+            except Exception as e:
+                st.error(f"Comparing importance engines failed: {e}")
+                comparison = None
+            if comparison is None and comparison_key in jobs:
+                st.fragment(run_every=2)(poll_job)(comparison_key, "Training each engine in the background…")
+            elif comparison is not None:
+                st.dataframe(comparison.style.format({
+                    'Rank correlation vs full forest': '{:.2f}',
+                    'Training time (s)': '{:.2f}',
+                    'Importance scoring (s)': '{:.2f}',
+                    'Peak memory (MB)': '{:.0f}'
+                }), use_container_width=True)
+    
+    with st.expander("🔮 What-if revenue predictor"):
+        classes = rf_artifact['classes']
+        what_if_cols = st.columns(3)
+        # An expander's body runs even while collapsed, so the defaults stay small (every product category
+        # against one value of each other input); values are sorted so click order does not change the cache key
+        choices = {
+            col: sorted(what_if_cols[i % 3].multiselect(
+                col.replace('_', ' '), list(classes[col]),
+                default=list(classes[col]) if col == 'Product_Category' else list(classes[col][:1]),
+                key=f"what_if_{col}"
+            ))
+            for i, col in enumerate(CATEGORICAL_FEATURES)
+        }
+        orders = what_if_cols[2].slider("Orders", int(df['Orders'].min()), int(df['Orders'].max()),
+                                        (int(df['Orders'].min()), int(df['Orders'].max())), key="what_if_orders")
+        n_scenarios = int(np.prod([len(v) for v in choices.values()])) * (orders[1] - orders[0] + 1)
+        
+        if n_scenarios == 0:
+            st.info("Pick at least one value for every input")
+        elif n_scenarios > WHAT_IF_MAX_SCENARIOS:
+            st.warning(f"{n_scenarios:,} scenarios exceeds the limit of {WHAT_IF_MAX_SCENARIOS:,}; narrow the inputs")
+        else:
+            what_if_key = ('what_if', model_artifact_path(df.attrs['fingerprint']),
+                           tuple((col, tuple(v)) for col, v in choices.items()), orders)
+            what_if = result_cache.get_or_compute(what_if_key, lambda: what_if_outputs(rf_artifact, choices, orders))
+            
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Scenarios scored", f"{what_if['count']:,}")
+            m2.metric("Mean predicted amount", f"₹{what_if['mean']:,.0f}")
+            m3.metric("Best scenario", f"₹{what_if['best']:,.0f}")
+            st.plotly_chart(what_if['figure'], use_container_width=True)
+            st.dataframe(what_if['top'], use_container_width=True)
+
 
 # Time Analysis (if date column exists)
-if 'Date' in df.columns:
+@st.fragment
+def time_section():
     st.markdown('<div class="section-header"><h2>⏰ Time Analysis</h2></div>', unsafe_allow_html=True)
-    time1, time2 = st.columns(2)
     
-    with time1:
-        # Sales by month
-        monthly_sales = filtered_df.groupby('Month')['Amount'].sum().reset_index()
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                      'July', 'August', 'September', 'October', 'November', 'December']
-        monthly_sales['Month'] = pd.Categorical(monthly_sales['Month'], categories=month_order, ordered=True)
-        monthly_sales = monthly_sales.sort_values('Month')
+    def build():
+        customer_aggregates = cached_section('customers', lambda: compute_customer_aggregates(filtered_rows()))
+        monthly_sales, daily_sales = customer_aggregates.monthly_sales, customer_aggregates.daily_sales
         
-        fig = px.line(
-            monthly_sales, 
-            x='Month', 
-            y='Amount', 
+        # Sales by month
+        monthly_fig = px.line(
+            monthly_sales,
+            x='Month',
+            y='Amount',
             markers=True,
             title='Monthly Sales Trend',
             line_shape='spline'
         )
-        fig.update_traces(line=dict(color='#CC0000', width=3))
-        fig.update_layout(
+        monthly_fig.update_traces(line=dict(color='#CC0000', width=3))
+        monthly_fig.update_layout(
             height=400,
             paper_bgcolor='rgba(0,0,0,0)',
             plot_bgcolor='rgba(0,0,0,0)',
             font=dict(color='white')
         )
-        st.plotly_chart(fig, use_container_width=True)
-    
-    with time2:
+        
         # Daily sales
-        daily_sales = filtered_df.groupby('Date')['Amount'].sum().reset_index()
-        fig = px.area(
-            daily_sales, 
-            x='Date', 
-            y='Amount', 
+        daily_fig = px.area(
+            daily_sales,
+            x='Date',
+            y='Amount',
             title='Daily Sales',
             color_discrete_sequence=['#138808']
         )
-        fig.update_layout(
+        daily_fig.update_layout(
             height=400,
             paper_bgcolor='rgba(0,0,0,0)',
             plot_bgcolor='rgba(0,0,0,0)',
             font=dict(color='white')
         )
-        st.plotly_chart(fig, use_container_width=True)
+        return monthly_fig, daily_fig
+    
+    monthly_fig, daily_fig = section_output('time', build)
+    time1, time2 = st.columns(2)
+    with time1:
+        st.plotly_chart(monthly_fig, use_container_width=True)
+    with time2:
+        st.plotly_chart(daily_fig, use_container_width=True)
 
 # Customer Segmentation
-st.markdown('<div class="section-header"><h2>👤 Customer Segmentation</h2></div>', unsafe_allow_html=True)
-st.markdown("RFM Analysis (Frequency, Monetary)")
+@st.fragment
+def segmentation_section():
+    st.markdown('<div class="section-header"><h2>👤 Customer Segmentation</h2></div>', unsafe_allow_html=True)
+    st.markdown("RFM Analysis (Recency, Frequency, Monetary)" if 'Date' in df.columns else "RFM Analysis (Frequency, Monetary)")
+    
+    def build():
+        # Calculate RFM and score it into quintiles and named segments
+        rfm = cached_section('customers', lambda: compute_customer_aggregates(filtered_rows())).rfm
+        # Only the per-segment summary is cached; per-customer scores would grow with the customer count
+        segments = cached_section('rfm_segments', lambda: score_rfm(rfm).segments)
+        
+        # Distribution plots
+        measures = [('Recency', '#AB63FA', ''), ('Frequency', '#FFA15A', ''), ('Monetary', '#00CC96', '₹')]
+        measures = [measure for measure in measures if measure[0] in rfm.columns]
+        fig = make_subplots(rows=1, cols=len(measures), subplot_titles=[f"{measure} Distribution" for measure, _, _ in measures])
+        
+        for col, (measure, color, prefix) in enumerate(measures, start=1):
+            counts, edges, labels = histogram_bins(rfm[measure].dropna().to_numpy(), prefix=prefix)
+            fig.add_trace(go.Bar(
+                x=(edges[:-1] + edges[1:]) / 2,
+                y=counts,
+                width=np.diff(edges) * 0.9,
+                name=measure,
+                marker_color=color,
+                customdata=labels,
+                hovertemplate='%{customdata}: %{y:,} customers<extra></extra>'
+            ), row=1, col=col)
+        
+        fig.update_layout(
+            height=400,
+            showlegend=False,
+            bargap=0.1,
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='white')
+        )
+        
+        # Customers per segment, with each segment's share of revenue on hover
+        segment_fig = px.bar(
+            segments.sort_values('Customers'),
+            x='Customers',
+            y='Segment',
+            orientation='h',
+            title='Customer Segments',
+            color='Revenue_Share',
+            color_continuous_scale='Oranges',
+            custom_data=['Revenue', 'Revenue_Share']
+        )
+        segment_fig.update_traces(hovertemplate='%{y}: %{x:,} customers<br>Revenue ₹%{customdata[0]:,.0f} (%{customdata[1]:.1%})<extra></extra>')
+        segment_fig.update_layout(
+            height=400,
+            coloraxis_colorbar=dict(title='Revenue Share', tickformat='.0%'),
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='white')
+        )
+        averages = rfm.mean()
+        return rfm.shape[0], averages, fig, segment_fig
+    
+    customers, averages, fig, segment_fig = section_output('segmentation', build)
+    
+    # Updated metrics layout
+    columns = iter(st.columns(4 if 'Recency' in averages else 3))
+    with next(columns):
+        st.metric("Total Customers", customers)
+    if 'Recency' in averages:
+        with next(columns):
+            st.metric("Avg Recency", f"{averages['Recency']:.0f} days")
+    with next(columns):
+        st.metric("Avg Frequency", f"{averages['Frequency']:.1f}")
+    with next(columns):
+        st.metric("Avg Monetary", f"₹{averages['Monetary']:,.0f}")
+    
+    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(segment_fig, use_container_width=True)
 
-# Calculate RFM
-rfm = filtered_df.groupby('User_ID').agg(
-    Frequency=('Orders', 'sum'),
-    Monetary=('Amount', 'sum')
-)
+# Only the section being viewed is computed and sent; st.tabs would run every tab's body on each rerun
+DASHBOARD_SECTIONS = {
+    "👥 Demographics": demographic_section,
+    "🗺️ Geography": geographic_section,
+    "📦 Products": product_section,
+    "🌳 Random Forest": model_section,
+    "⏰ Time": time_section,
+    "👤 Segmentation": segmentation_section,
+}
+if 'Date' not in df.columns:
+    del DASHBOARD_SECTIONS["⏰ Time"]
 
-# Updated metrics layout
-col1, col2, col3 = st.columns(3)
-with col1:
-    st.metric("Total Customers", rfm.shape[0])
-with col2:
-    st.metric("Avg Frequency", f"{rfm['Frequency'].mean():.1f}")
-with col3:
-    st.metric("Avg Monetary", f"₹{rfm['Monetary'].mean():,.0f}")
-
-# Distribution plots
-fig = make_subplots(rows=1, cols=2, subplot_titles=('Frequency Distribution', 'Monetary Distribution'))
-
-fig.add_trace(go.Histogram(
-    x=rfm['Frequency'], 
-    name='Frequency',
-    marker_color='#FFA15A'
-), row=1, col=1)
-
-fig.add_trace(go.Histogram(
-    x=rfm['Monetary'], 
-    name='Monetary',
-    marker_color='#00CC96'
-), row=1, col=2)
-
-fig.update_layout(
-    height=400, 
-    showlegend=False,
-    bargap=0.1,
-    paper_bgcolor='rgba(0,0,0,0)',
-    plot_bgcolor='rgba(0,0,0,0)',
-    font=dict(color='white')
+selected_section = st.radio(
+    "Section",
+    list(DASHBOARD_SECTIONS),
+    index=None,
+    horizontal=True,
+    key="dashboard_section",
+    label_visibility="collapsed"
 )
-st.plotly_chart(fig, use_container_width=True)
+if selected_section is None:
+    st.caption("Choose a section above to load it")
+else:
+    DASHBOARD_SECTIONS[selected_section]()
 
 # Key Insights & Conclusions Section
 st.markdown('<div class="section-header"><h2>💡 Key Insights & Conclusions</h2></div>', unsafe_allow_html=True)
@@ -1277,6 +2481,11 @@ with insight_col2:
     </div>
     """, unsafe_allow_html=True)
 
+# Shared result cache counters
+with performance_panel:
+    st.write(f"Result cache: {result_cache.hits} hits, {result_cache.misses} misses, {result_cache.evictions} evictions "
+             f"({result_cache.nbytes / 1024 ** 2:.1f} of {RESULT_CACHE_MB:.0f} MB)")
+
 # Footer
 st.markdown("""
 <div class="footer">
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+# Pre-aggregated cube: the sidebar filter dimensions crossed with the chart dimensions
+CUBE_DIMENSIONS = ['Gender', 'Age_Category', 'State', 'Product_Category', 'Spending_Segment', 'Zone']
+
+def aggregate_cube(data):
+    return data.groupby(CUBE_DIMENSIONS, observed=True, dropna=False).agg(
+        Amount_sum=('Amount', 'sum'),
+        Amount_count=('Amount', 'count'),
+        Orders_sum=('Orders', 'sum'),
+        Orders_count=('Orders', 'count')
+    ).reset_index()
+
+def bincount_agg(frame, by, observed=True, **aggregations):
+    # groupby(by).agg(...) over a categorical key as one bincount per aggregation
+    key = frame[by]
+    codes = key.cat.codes.to_numpy()
+    valid = codes >= 0
+    codes = codes[valid]
+    n_groups = len(key.cat.categories)
+    counts = np.bincount(codes, minlength=n_groups)
+    
+    result = {}
+    for name, (col, how) in aggregations.items():
+        values = frame[col].to_numpy()[valid]
+        if how == 'count':
+            result[name] = counts
+            continue
+        sums = np.bincount(codes, weights=values, minlength=n_groups)
+        if how == 'sum':
+            # Float64 sums of integers are exact below 2**53
+            result[name] = sums.astype(np.int64) if np.issubdtype(values.dtype, np.integer) else sums
+        elif how == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[name] = sums / counts
+        else:
+            raise ValueError(f"Unsupported aggregation: {how}")
+    
+    index = pd.CategoricalIndex(key.cat.categories, dtype=key.dtype, name=by)
+    grouped = pd.DataFrame(result, index=index)
+    return grouped[counts > 0] if observed else grouped
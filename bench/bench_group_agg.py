@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aggregation import aggregate_cube, bincount_agg
+from feature_engineering import clean_data
+
+# Compares the bincount kernel behind group_agg with pandas groupby(...).agg on the dashboard's
+# rollups: on the cube built from the bundled CSV and on synthetic 1M-row frames.
+# Run from the repo root: python bench/bench_group_agg.py [rows]
+
+ROLLUPS = {
+    'State': dict(Orders=('Orders_sum', 'sum'), Revenue=('Amount_sum', 'sum')),
+    'Gender': dict(Amount_count=('Amount_count', 'sum'), Amount_sum=('Amount_sum', 'sum')),
+    'Product_Category': dict(Orders=('Orders_sum', 'sum'), Revenue=('Amount_sum', 'sum'), Cells=('Amount_sum', 'count')),
+    'Age_Category': dict(Avg_Amount=('Amount_sum', 'mean')),
+}
+
+def best_of(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def load_cube():
+    raw = pd.read_csv(os.path.join(ROOT, 'Diwali Sales Data.csv'), encoding='unicode_escape')
+    data = clean_data(raw)
+    for col in ['Gender', 'State', 'Zone', 'Product_Category']:
+        data[col] = data[col].astype('category')
+    cube = aggregate_cube(data)
+    for col in ['Gender', 'State', 'Zone', 'Product_Category']:
+        cube[col] = cube[col].astype(data[col].dtype)
+    return cube
+
+def synthetic_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    states = [f"State {i}" for i in range(36)]
+    categories = [f"Category {i}" for i in range(18)]
+    return pd.DataFrame({
+        'State': pd.Categorical.from_codes(rng.integers(0, len(states), rows), states),
+        'Gender': pd.Categorical.from_codes(rng.integers(0, 2, rows), ['F', 'M']),
+        'Product_Category': pd.Categorical.from_codes(rng.integers(0, len(categories), rows), categories),
+        'Age_Category': pd.Categorical.from_codes(rng.integers(0, 5, rows), [f"Age {i}" for i in range(5)], ordered=True),
+        'Orders_sum': rng.integers(1, 5, rows),
+        'Amount_sum': rng.integers(100, 25000, rows),
+        'Amount_count': np.ones(rows, dtype=np.int64),
+    })
+
+def compare(name, frame):
+    print(f"{name} ({len(frame):,} rows)")
+    for by, aggregations in ROLLUPS.items():
+        expected = frame.groupby(by, observed=True).agg(**aggregations)
+        result = bincount_agg(frame, by, **aggregations)
+        # Group order is not part of the contract; callers sort the rollups themselves
+        pd.testing.assert_frame_equal(result.sort_index(), expected.sort_index(), check_dtype=False)
+        pandas_time = best_of(lambda: frame.groupby(by, observed=True).agg(**aggregations))
+        numpy_time = best_of(lambda: bincount_agg(frame, by, **aggregations))
+        print(f"  {by:<17} pandas {pandas_time * 1e3:8.2f} ms   bincount {numpy_time * 1e3:8.2f} ms"
+              f"   {pandas_time / numpy_time:5.1f}x")
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    compare('cube', load_cube())
+    compare('synthetic', synthetic_frame(rows))
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rfm import SEGMENT_NAMES, quintile_scores, score_rfm
+
+# Compares the percentile + searchsorted quintile scoring behind the RFM segments with the usual
+# rank + pd.qcut recipe, on synthetic customer tables.
+# Run from the repo root: python bench/bench_rfm.py [customers ...]
+
+def best_of(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def synthetic_rfm(customers, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Recency': rng.integers(0, 365, customers),
+        'Frequency': rng.geometric(0.3, customers),
+        'Monetary': rng.gamma(2, 20000, customers),
+    }, index=pd.RangeIndex(customers, name='User_ID'))
+
+def qcut_scores(rfm):
+    # Ranking first breaks ties so qcut always finds five distinct bins
+    return pd.DataFrame({
+        'R': pd.qcut(rfm['Recency'].rank(method='first', ascending=False), 5, labels=False) + 1,
+        'F': pd.qcut(rfm['Frequency'].rank(method='first'), 5, labels=False) + 1,
+        'M': pd.qcut(rfm['Monetary'].rank(method='first'), 5, labels=False) + 1,
+    }, index=rfm.index)
+
+def check(rfm, result):
+    # On continuous values the cut points are the ones qcut picks, so the monetary scores agree exactly
+    expected = pd.qcut(rfm['Monetary'], 5, labels=False).to_numpy() + 1
+    np.testing.assert_array_equal(quintile_scores(rfm['Monetary'].to_numpy()), expected)
+    np.testing.assert_array_equal(result.scores['M'].to_numpy(), expected)
+
+    # Segment totals cover every customer and all revenue
+    segments = result.segments
+    assert segments['Customers'].sum() == len(rfm)
+    assert np.isclose(segments['Revenue'].sum(), rfm['Monetary'].sum())
+    counts = result.scores['Segment'].value_counts()
+    assert (counts.reindex(segments['Segment']).to_numpy() == segments['Customers'].to_numpy()).all()
+    assert set(segments['Segment']) <= set(SEGMENT_NAMES)
+    # The segments-only call the dashboard caches gives the same summary
+    pd.testing.assert_frame_equal(score_rfm(rfm).segments, segments)
+    assert score_rfm(rfm).scores is None
+
+def compare(customers):
+    rfm = synthetic_rfm(customers)
+    result = score_rfm(rfm, per_customer=True)
+    check(rfm, result)
+
+    # Recency and frequency are heavily tied; ties share a score here while rank splits them arbitrarily
+    baseline = qcut_scores(rfm)
+    agreement = {col: (result.scores[col].to_numpy() == baseline[col].to_numpy()).mean() for col in ['R', 'F', 'M']}
+
+    # Timed with the per-customer scores, since the baseline produces them too
+    ours = best_of(lambda: score_rfm(rfm, per_customer=True))
+    theirs = best_of(lambda: qcut_scores(rfm))
+    print(f"{customers:>12,} customers   rank+qcut {theirs:6.2f} s   score_rfm {ours:6.2f} s   {theirs / ours:5.1f}x"
+          f"   agreement R {agreement['R']:.0%} F {agreement['F']:.0%} M {agreement['M']:.0%}")
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000_000, 10_000_000]
+    for customers in sizes:
+        compare(customers)
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+# Cleaning and derived-column rules, kept out of App.py so they can be imported without starting Streamlit.
+# Bump CACHE_FORMAT in App.py whenever these change so stale stores are rebuilt
+
+# Bins for the derived columns; each becomes an ordered categorical
+AGE_BINS = [-np.inf, 20, 30, 40, 50, np.inf]
+AGE_LABELS = ['Teen (0-19)', 'Young Adult (20-29)', 'Adult (30-39)', 'Middle Age (40-49)', 'Senior (50+)']
+SPENDING_BINS = [0, 5000, 10000, 15000, 20000, np.inf]
+SPENDING_LABELS = ['Low (<5k)', 'Medium (5-10k)', 'High (10-15k)', 'Premium (15-20k)', 'Elite (20k+)']
+MONTH_ORDER = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+def clean_data(df):
+    # Data cleaning steps
+    df.drop(['Status', 'unnamed1'], axis=1, inplace=True, errors='ignore')
+    df.dropna(inplace=True)
+    df['Amount'] = df['Amount'].astype(int)
+    df.rename(columns={'Marital_Status': 'Married', 'Age Group': 'Age_Group'}, inplace=True)
+    
+    # Feature engineering (vectorized binning, left-closed so age 20 is a Young Adult)
+    df['Age_Category'] = pd.cut(df['Age'], bins=AGE_BINS, labels=AGE_LABELS, right=False)
+    df['Spending_Segment'] = pd.cut(df['Amount'], bins=SPENDING_BINS, labels=SPENDING_LABELS)
+    
+    # Create month column from date
+    if 'Date' in df.columns:
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+        df['Month'] = pd.Categorical(df['Date'].dt.month_name(), categories=MONTH_ORDER, ordered=True)
+    
+    # Columnar stores need a default index
+    return df.reset_index(drop=True)
@@ -0,0 +1,97 @@
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
+from sklearn.inspection import permutation_importance
+
+from process_memory import process_memory_mb, reset_peak_rss
+
+# Feature-importance engines, importable so a worker process can train them
+MODEL_FEATURES = ['Gender', 'Age_Category', 'State', 'Occupation', 'Product_Category', 'Orders']
+CATEGORICAL_FEATURES = ['Gender', 'Age_Category', 'State', 'Occupation', 'Product_Category']
+
+def encode_features(data):
+    # Categorical codes are stable for a dataset version, so the fitted model can score any later subset
+    return pd.DataFrame({
+        col: data[col].cat.codes if col in CATEGORICAL_FEATURES else data[col]
+        for col in MODEL_FEATURES
+    })
+
+def train_importance_model(data, mode='rf', sample=1.0, max_depth=None):
+    # Stratified row subsample keeps every product category represented
+    if sample < 1:
+        data = data.groupby('Product_Category', observed=True, group_keys=False).sample(frac=sample, random_state=42)
+    
+    # Features and target
+    X = encode_features(data)
+    y = data['Amount']
+    
+    # train_seconds is the fit alone, so the engines compare like with like; computing importances
+    # (permutation scoring for boosting) is timed separately
+    started = time.perf_counter()
+    if mode == 'hgb':
+        # Histogram boosting splits natively on the categorical codes
+        model = HistGradientBoostingRegressor(
+            categorical_features=[MODEL_FEATURES.index(col) for col in CATEGORICAL_FEATURES],
+            max_depth=max_depth,
+            random_state=42
+        )
+        model.fit(X, y)
+        train_seconds = time.perf_counter() - started
+        # Boosting has no impurity importances; permute features on a bounded sample instead
+        scored = X.sample(n=min(len(X), 20000), random_state=42)
+        importances = permutation_importance(
+            model, scored, y.loc[scored.index], n_repeats=5, random_state=42, n_jobs=-1
+        ).importances_mean.clip(min=0)
+        importances = importances / importances.sum() if importances.sum() > 0 else importances
+    else:
+        # Train model on all cores
+        model = RandomForestRegressor(n_estimators=100, max_depth=max_depth, random_state=42, n_jobs=-1)
+        model.fit(X, y)
+        train_seconds = time.perf_counter() - started
+        importances = model.feature_importances_
+    importance_seconds = time.perf_counter() - started - train_seconds
+    
+    # Get feature importances
+    feature_importance = pd.DataFrame({'Feature': MODEL_FEATURES, 'Importance': importances})
+    feature_importance = feature_importance.sort_values('Importance', ascending=False)
+    
+    return {
+        'model': model,
+        'classes': {col: data[col].cat.categories for col in CATEGORICAL_FEATURES},
+        'feature_importance': feature_importance,
+        'mode': mode,
+        'sample': sample,
+        'max_depth': max_depth,
+        'train_seconds': train_seconds,
+        'importance_seconds': importance_seconds
+    }
+
+def measure_importance_mode(data, **config):
+    # Meant to run alone in a fresh worker process, so the peak is this mode's and tracing slows no one else.
+    # RSS growth catches the trees' native allocations, tracemalloc catches NumPy buffers
+    # served from memory the allocator had already reserved; the larger of the two is reported
+    rss_baseline = reset_peak_rss()
+    tracemalloc.start()
+    try:
+        run = train_importance_model(data, **config)
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+    if rss_baseline is not None:
+        peak_memory_mb = max(peak_memory_mb, process_memory_mb()['VmHWM'] - rss_baseline)
+    
+    # The fitted model stays in the worker; only the comparison figures are sent back
+    return {
+        'feature_importance': run['feature_importance'],
+        'train_seconds': run['train_seconds'],
+        'importance_seconds': run['importance_seconds'],
+        'peak_memory_mb': peak_memory_mb
+    }
+
+if __name__ == '__main__':
+    # Worker entry point: python -m importance <job.pkl> <result.pkl>, one mode per process
+    data, config = pd.read_pickle(sys.argv[1])
+    pd.to_pickle(measure_importance_mode(data, **config), sys.argv[2])
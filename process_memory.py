@@ -0,0 +1,21 @@
+# Resident-memory readings for the current process; Linux only, None elsewhere
+
+def process_memory_mb():
+    # Current resident memory split into private (anonymous) and file-backed pages
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return {key: int(status[key].split()[0]) / 1024 for key in ('VmRSS', 'VmHWM', 'RssAnon', 'RssFile')}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def reset_peak_rss():
+    # Linux can reset the VmHWM high-water mark; returns the RSS it was reset to, or None elsewhere.
+    # This resets the whole process's mark, so only call it from a process doing one measured job
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return None
+    memory = process_memory_mb()
+    return memory['VmRSS'] if memory else None
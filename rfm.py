@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Optional
+
+# RFM scores and named segments
+SEGMENT_NAMES = [
+    'Champions', 'Loyal Customers', 'Potential Loyalists', 'New Customers', 'Promising', 'Need Attention',
+    'About to Sleep', 'At Risk', "Can't Lose", 'Hibernating', 'Big Spenders', 'Low Value',
+]
+
+def segment_grid(rows):
+    return np.array([[SEGMENT_NAMES.index(name) for name in row] for row in rows], dtype=np.int8)
+
+# Rows are the recency score (1 = longest ago), columns the mean of the frequency and monetary scores
+RFM_SEGMENT_GRID = segment_grid([
+    ['Hibernating', 'Hibernating', 'At Risk', 'At Risk', "Can't Lose"],
+    ['Hibernating', 'Hibernating', 'At Risk', 'At Risk', "Can't Lose"],
+    ['About to Sleep', 'About to Sleep', 'Need Attention', 'Loyal Customers', 'Loyal Customers'],
+    ['Promising', 'Potential Loyalists', 'Potential Loyalists', 'Loyal Customers', 'Loyal Customers'],
+    ['New Customers', 'Potential Loyalists', 'Potential Loyalists', 'Champions', 'Champions'],
+])
+# Without a Date column there is no recency, so rows are the frequency score and columns the monetary score
+FM_SEGMENT_GRID = segment_grid([
+    ['Low Value', 'Low Value', 'Need Attention', 'Big Spenders', 'Big Spenders'],
+    ['Low Value', 'Need Attention', 'Need Attention', 'Big Spenders', 'Big Spenders'],
+    ['Need Attention', 'Potential Loyalists', 'Potential Loyalists', 'Potential Loyalists', 'Big Spenders'],
+    ['Loyal Customers', 'Loyal Customers', 'Loyal Customers', 'Champions', 'Champions'],
+    ['Loyal Customers', 'Loyal Customers', 'Loyal Customers', 'Champions', 'Champions'],
+])
+
+def quintile_scores(values):
+    # np.percentile finds the four cut points by partial selection rather than a full sort, and
+    # searchsorted against them is O(n); ties fall to the lower score. Missing values score 1
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    scores = np.ones(len(values), dtype=np.int8)
+    if valid.any():
+        cuts = np.percentile(values[valid], [20, 40, 60, 80])
+        scores[valid] = np.searchsorted(cuts, values[valid], side='left') + 1
+    return scores
+
+@dataclass(frozen=True)
+class RFMScores:
+    # scores holds one row per customer and is only built on request; segments is one row per segment
+    scores: Optional[pd.DataFrame]
+    segments: pd.DataFrame
+
+def score_rfm(rfm, per_customer=False):
+    f_scores = quintile_scores(rfm['Frequency'].to_numpy())
+    m_scores = quintile_scores(rfm['Monetary'].to_numpy())
+    r_scores = None
+    if 'Recency' in rfm.columns:
+        # Fewer days since the last purchase is better, so recency is scored negated
+        r_scores = quintile_scores(-rfm['Recency'].to_numpy(dtype=float))
+        codes = RFM_SEGMENT_GRID[r_scores - 1, (f_scores + m_scores + 1) // 2 - 1]
+    else:
+        codes = FM_SEGMENT_GRID[f_scores - 1, m_scores - 1]
+    
+    scores = None
+    if per_customer:
+        scores = pd.DataFrame({'F': f_scores, 'M': m_scores}, index=rfm.index)
+        if r_scores is not None:
+            scores.insert(0, 'R', r_scores)
+        scores['Segment'] = pd.Categorical.from_codes(codes, categories=SEGMENT_NAMES)
+    
+    # Segment totals are bincounts over the segment codes
+    customers = np.bincount(codes, minlength=len(SEGMENT_NAMES))
+    revenue = np.bincount(codes, weights=rfm['Monetary'].to_numpy(dtype=float), minlength=len(SEGMENT_NAMES))
+    segments = pd.DataFrame({'Segment': SEGMENT_NAMES, 'Customers': customers, 'Revenue': revenue})
+    segments = segments[segments['Customers'] > 0].reset_index(drop=True)
+    segments['Revenue_Share'] = segments['Revenue'] / max(segments['Revenue'].sum(), 1)
+    return RFMScores(scores=scores, segments=segments)
@@ -0,0 +1,41 @@
+import pandas as pd
+import pyarrow as pa
+
+# The cleaned dataset as shared by every session in a worker process
+
+def read_store(path):
+    # Memory-map the store read-only. Columns come back as zero-copy views of the OS page cache,
+    # so every worker process on the node shares one physical copy of the data.
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.to_pandas(split_blocks=True)
+
+class SharedFrame(pd.DataFrame):
+    # The cleaned dataset as held once per process; filters, groupbys and copies of it are plain DataFrames
+    @property
+    def _constructor(self):
+        return pd.DataFrame
+    
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The shared dataset is read-only; call .copy() before modifying it")
+    
+    # Every path that swaps a column, the block manager or an axis is refused before it changes anything:
+    # pandas renames axes before calling _update_inplace, so guarding that alone left half-applied writes
+    __setitem__ = __delitem__ = insert = isetitem = _update_inplace = _read_only
+    _set_axis = _iset_item_mgr = _set_item_mgr = _read_only
+    
+    def __setattr__(self, name, value):
+        # The columns/index setters (and so inplace set_axis, rename, set_index) and .loc enlargement
+        # assign these; construction and unpickling set _mgr before it exists on the instance
+        if name in ('columns', 'index', '_mgr') and '_mgr' in self.__dict__:
+            self._read_only()
+        super().__setattr__(name, value)
+    
+    def _consolidate_inplace(self):
+        # Keep one block per column; consolidating would copy the memory-mapped buffers
+        pass
+
+def share_frame(df):
+    # Read-only buffers make in-place writes through .loc/.iloc fail instead of leaking into other sessions
+    for block in df._mgr.blocks:
+        getattr(block.values, '_ndarray', block.values).flags.writeable = False
+    return SharedFrame(df)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_engineering import AGE_BINS, AGE_LABELS, SPENDING_LABELS, clean_data
+
+BOUNDARY_AGES = [0, 12, 19, 20, 29, 30, 39, 40, 49, 50, 92]
+
+def original_age_category(x):
+    # Row-wise rule the vectorized pd.cut replaced
+    return ('Teen (0-19)' if x < 20 else
+            'Young Adult (20-29)' if x < 30 else
+            'Adult (30-39)' if x < 40 else
+            'Middle Age (40-49)' if x < 50 else
+            'Senior (50+)')
+
+def test_age_bins_match_original_lambda_at_boundaries():
+    ages = pd.Series(BOUNDARY_AGES)
+    binned = pd.cut(ages, bins=AGE_BINS, labels=AGE_LABELS, right=False)
+    assert binned.astype(str).tolist() == ages.apply(original_age_category).tolist()
+
+def test_age_bins_match_original_lambda_on_random_ages():
+    ages = pd.Series(np.random.default_rng(0).integers(0, 100, 100_000))
+    binned = pd.cut(ages, bins=AGE_BINS, labels=AGE_LABELS, right=False)
+    assert (binned.astype(str) == ages.apply(original_age_category)).all()
+
+def test_clean_data_derives_ordered_categories():
+    raw = pd.DataFrame({
+        'User_ID': [1, 2, 3, 4],
+        'Age Group': ['18-25', '18-25', '26-35', '46-50'],
+        'Age': [19, 20, 30, 50],
+        'Marital_Status': [0, 1, 0, 1],
+        'Orders': [1, 2, 3, 4],
+        'Amount': [4999.0, 5000.0, 12000.0, 25000.0],
+        'Status': [None] * 4,
+        'unnamed1': [None] * 4,
+    })
+    cleaned = clean_data(raw)
+    assert cleaned['Age_Category'].tolist() == [original_age_category(age) for age in [19, 20, 30, 50]]
+    assert cleaned['Spending_Segment'].tolist() == ['Low (<5k)', 'Low (<5k)', 'High (10-15k)', 'Elite (20k+)']
+    assert list(cleaned['Spending_Segment'].cat.categories) == SPENDING_LABELS
+    assert cleaned['Age_Category'].cat.ordered
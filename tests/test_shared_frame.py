@@ -0,0 +1,77 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_frame import read_store, share_frame
+
+ORIGINAL = pd.DataFrame({
+    'User_ID': np.arange(6, dtype=np.int64),
+    'Amount': np.arange(6, dtype=np.float64),
+    'State': pd.Categorical(['a', 'a', 'b', 'b', 'c', 'c']),
+})
+
+# Every attempt must fail and leave the shared frame exactly as it was
+WRITES = {
+    'rename columns': lambda df: df.rename(columns={'Amount': 'x'}, inplace=True),
+    'rename index': lambda df: df.rename(index={0: 9}, inplace=True),
+    'rename_axis': lambda df: df.rename_axis('row', inplace=True),
+    'set_index': lambda df: df.set_index('User_ID', inplace=True),
+    'set_index keep': lambda df: df.set_index('User_ID', drop=False, inplace=True),
+    'reset_index': lambda df: df.reset_index(inplace=True),
+    'reset_index drop': lambda df: df.reset_index(drop=True, inplace=True),
+    'drop': lambda df: df.drop(columns='Amount', inplace=True),
+    'dropna': lambda df: df.dropna(inplace=True),
+    'fillna': lambda df: df.fillna(0, inplace=True),
+    'replace': lambda df: df.replace(1.0, 5.0, inplace=True),
+    'sort_values': lambda df: df.sort_values('Amount', ascending=False, inplace=True),
+    'sort_index': lambda df: df.sort_index(ascending=False, inplace=True),
+    'query': lambda df: df.query('Amount > 2', inplace=True),
+    'eval': lambda df: df.eval('y = Amount * 2', inplace=True),
+    'drop_duplicates': lambda df: df.drop_duplicates('State', inplace=True),
+    'clip': lambda df: df.clip(lower=0, upper=1, inplace=True),
+    'where': lambda df: df.where(df.notna(), inplace=True),
+    'update': lambda df: df.update(pd.DataFrame({'Amount': [9.0] * 6})),
+    'setitem': lambda df: df.__setitem__('Amount', 1.0),
+    'delitem': lambda df: df.__delitem__('Amount'),
+    'pop': lambda df: df.pop('Amount'),
+    'insert': lambda df: df.insert(0, 'z', 1),
+    'isetitem': lambda df: df.isetitem(1, 'abc'),
+    'loc column': lambda df: df.loc.__setitem__((slice(None), 'Amount'), 'abc'),
+    'loc value': lambda df: df.loc.__setitem__((0, 'Amount'), 5.0),
+    'iloc column': lambda df: df.iloc.__setitem__((slice(None), 1), 'abc'),
+    'loc new column': lambda df: df.loc.__setitem__((slice(None), 'new'), 1),
+    'loc new row': lambda df: df.loc.__setitem__(99, 1),
+    'columns setter': lambda df: setattr(df, 'columns', ['a', 'b', 'c']),
+    'index setter': lambda df: setattr(df, 'index', pd.RangeIndex(1, 7)),
+    'inplace add': lambda df: df.__iadd__(1),
+}
+
+@pytest.fixture
+def shared(tmp_path):
+    # The same memory-mapped Arrow store load_data reads
+    path = str(tmp_path / 'store.arrow')
+    table = pa.Table.from_pandas(ORIGINAL, preserve_index=False)
+    with pa.ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+    return share_frame(read_store(path))
+
+@pytest.mark.parametrize('write', WRITES.values(), ids=WRITES.keys())
+def test_failed_write_leaves_frame_unchanged(shared, write):
+    with pytest.raises((TypeError, ValueError)):
+        write(shared)
+    pd.testing.assert_frame_equal(shared, ORIGINAL, check_frame_type=False)
+
+def test_reads_and_copies_still_work(shared):
+    renamed = shared.rename(columns={'Amount': 'x'}).set_index('User_ID')
+    renamed['y'] = 1
+    assert type(renamed) is pd.DataFrame
+    assert list(renamed.columns) == ['x', 'State', 'y']
+    assert shared.set_axis(['a', 'b', 'c'], axis=1).columns.tolist() == ['a', 'b', 'c']
+    assert shared.groupby('State', observed=True)['Amount'].sum().tolist() == [1.0, 5.0, 9.0]
+    pd.testing.assert_frame_equal(shared, ORIGINAL, check_frame_type=False)